@@ -0,0 +1,149 @@
+"""
+Сравнение задержки AuthMiddleware: старая версия на BaseHTTPMiddleware против ASGI.
+
+Запуск:
+    python benchmarks/bench_auth_middleware.py --requests 5000
+
+Кэш пользователей заполняется заранее, а список отзывов считается синхронизированным,
+поэтому замер показывает накладные расходы самого middleware (разбор токена, лишние
+задачи и потоки), а не БД. БД не нужна: DATABASE_URL указывает на временную SQLite.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# До импорта приложения: настройки читаются из окружения при импорте
+os.environ["DATABASE_URL"] = f"sqlite:///{Path(tempfile.mkdtemp(prefix='bench_')) / 'bench.db'}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["DB_ASYNC"] = "0"
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import models.role  # noqa: F401 - связи User разрешаются по имени класса
+import models.user  # noqa: F401
+from benchmarks.loadtest import percentile
+from middlewares.auth_middleware import AuthMiddleware
+from services.auth_tokens import revocation_list
+from services.principal_cache import Principal, RoleRef, get_cached_principal, principal_cache
+from utils.security import create_access_token, decode_access_token
+
+BENCH_USER_ID = 10 ** 9
+
+
+class LegacyAuthMiddleware(BaseHTTPMiddleware):
+    """Версия до перехода на чистый ASGI (с тем же кэшем пользователей)"""
+
+    async def dispatch(self, request: Request, call_next):
+        token = request.headers.get("Authorization")
+        request.state.user = None
+        if token and token.startswith("Bearer "):
+            payload = decode_access_token(token[7:])
+            if payload:
+                user = get_cached_principal(payload.get("user_id"), payload.get("iat"))
+                if user and user.is_active:
+                    request.state.user = user
+        return await call_next(request)
+
+
+async def me(request: Request):
+    user = request.state.user
+    return JSONResponse({"id": user.id if user else None})
+
+
+def build_app(middleware_class):
+    routes = [Route("/", me), Route("/users/me", me)]
+    return Starlette(routes=routes, middleware=[Middleware(middleware_class)])
+
+
+def make_scope(path: str, token: str = None):
+    headers = [(b"host", b"bench")]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+
+
+def make_receive():
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+async def run_case(app, path: str, token: str, requests: int):
+    async def send(message):
+        pass
+
+    timings = []
+    for _ in range(requests):
+        scope, receive = make_scope(path, token), make_receive()
+        started = time.perf_counter()
+        await app(scope, receive, send)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+def report(name: str, timings):
+    timings = sorted(timings)
+    p50, p99 = percentile(timings, 50), percentile(timings, 99)
+    print(f"{name:<30} mean={statistics.mean(timings):8.1f}us  p50={p50:8.1f}us  p99={p99:8.1f}us")
+
+
+async def main(requests: int):
+    # Отзывов нет и догружать их неоткуда: middleware не ходит в БД
+    revocation_list.sync_seconds = float("inf")
+    principal_cache.set(BENCH_USER_ID, Principal(
+        id=BENCH_USER_ID,
+        first_name="Bench",
+        last_name="User",
+        email="bench@example.com",
+        role_id=2,
+        role=RoleRef(id=2, name="user"),
+        is_active=True,
+        loaded_at=time.time() + 60,
+    ))
+    token = create_access_token({"user_id": BENCH_USER_ID})
+
+    for label, middleware_class in (("before (BaseHTTPMiddleware)", LegacyAuthMiddleware),
+                                    ("after (ASGI)", AuthMiddleware)):
+        app = build_app(middleware_class)
+        # Прогрев
+        await run_case(app, "/users/me", token, 100)
+        print(label)
+        report("  public GET /", await run_case(app, "/", None, requests))
+        report("  authenticated GET /users/me", await run_case(app, "/users/me", token, requests))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
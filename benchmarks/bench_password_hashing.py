@@ -0,0 +1,87 @@
+"""
+Задержка проверки пароля для разных схем и параметров хеширования.
+
+Запуск:
+    python benchmarks/bench_password_hashing.py --iterations 20
+    python benchmarks/bench_password_hashing.py --json > hashing.json
+
+По p50 проверки можно оценить пропускную способность логина на ядро:
+logins/sec/core ~ 1 / p50.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from passlib.exc import MissingBackendError
+
+from benchmarks.loadtest import percentile
+from utils.security import build_password_context
+
+# (название, параметры build_password_context)
+CASES = [
+    ("bcrypt rounds=10", {"schemes": ["bcrypt"], "bcrypt_rounds": 10}),
+    ("bcrypt rounds=11", {"schemes": ["bcrypt"], "bcrypt_rounds": 11}),
+    ("bcrypt rounds=12", {"schemes": ["bcrypt"], "bcrypt_rounds": 12}),
+    ("argon2id m=19MiB t=2 p=1", {"schemes": ["argon2"], "argon2_memory_cost": 19456,
+                                  "argon2_time_cost": 2, "argon2_parallelism": 1}),
+    ("argon2id m=64MiB t=3 p=4", {"schemes": ["argon2"], "argon2_memory_cost": 65536,
+                                  "argon2_time_cost": 3, "argon2_parallelism": 4}),
+]
+
+
+def bench_case(options: dict, iterations: int) -> dict:
+    context = build_password_context(**options)
+    hashed = context.hash("benchmark-password")
+    context.verify("benchmark-password", hashed)
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        context.verify("benchmark-password", hashed)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    p50 = percentile(timings, 50)
+    return {
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": p50,
+        "p95_ms": percentile(timings, 95),
+        "verifies_per_sec_per_core": 1000 / p50,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, options in CASES:
+        try:
+            results[name] = bench_case(options, args.iterations)
+        except MissingBackendError:
+            # argon2 требует пакет argon2-cffi
+            results[name] = None
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, result in results.items():
+        if result is None:
+            print(f"{name:<26} пропущено: нет бэкенда")
+            continue
+        print(
+            f"{name:<26} mean={result['mean_ms']:7.1f}ms  p50={result['p50_ms']:7.1f}ms  "
+            f"p95={result['p95_ms']:7.1f}ms  ~{result['verifies_per_sec_per_core']:6.1f} verify/s/core"
+        )
+
+
+if __name__ == "__main__":
+    main()
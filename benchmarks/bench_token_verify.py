@@ -0,0 +1,90 @@
+"""
+Микробенчмарк проверки JWT: прежний jwt.decode со строковым ключом против TokenVerifier.
+
+Запуск:
+    python benchmarks/bench_token_verify.py --iterations 20000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import jwt
+
+from utils.security import ALGORITHM, SECRET_KEY
+from utils.tokens import KeyRing, TokenVerifier
+
+
+def legacy_decode(token: str):
+    """decode_access_token до появления TokenVerifier"""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+
+
+def measure(name: str, fn, token: str, iterations: int):
+    fn(token)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(token)
+    per_call = (time.perf_counter() - started) / iterations * 1_000_000
+    print(f"{name:<34} {per_call:8.2f}us/verify")
+
+
+def rsa_keyring():
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+    except ImportError:
+        return None
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    keyring = KeyRing()
+    keyring.add_asymmetric("RS256", "bench", private_key=pem, active=True)
+    return keyring
+
+
+def main(iterations: int):
+    claims = {"user_id": 1, "exp": int(time.time()) + 3600, "iat": int(time.time())}
+
+    hmac_keyring = KeyRing()
+    hmac_keyring.add_symmetric(SECRET_KEY, ALGORITHM)
+    token = TokenVerifier(hmac_keyring).sign(claims)
+
+    print(f"{ALGORITHM}:")
+    measure("  jwt.decode (before)", legacy_decode, token, iterations)
+    measure("  TokenVerifier, cache miss", TokenVerifier(hmac_keyring)._decode, token, iterations)
+    warm = TokenVerifier(hmac_keyring)
+    measure("  TokenVerifier, cache hit", warm.verify, token, iterations)
+
+    keyring = rsa_keyring()
+    if keyring is None:
+        print("RS256: пропущено, нужен пакет cryptography")
+        return
+    rsa_token = TokenVerifier(keyring).sign(claims)
+    public_pem = public_key_pem(keyring.get("bench").verify_key)
+    rsa_iterations = max(iterations // 10, 1)
+    print("RS256:")
+    measure("  jwt.decode с PEM-строкой (before)",
+            lambda t: jwt.decode(t, public_pem, algorithms=["RS256"]), rsa_token, rsa_iterations)
+    measure("  TokenVerifier, cache miss", TokenVerifier(keyring)._decode, rsa_token, rsa_iterations)
+    measure("  TokenVerifier, cache hit", TokenVerifier(keyring).verify, rsa_token, iterations)
+
+
+def public_key_pem(public_key) -> str:
+    from cryptography.hazmat.primitives import serialization
+    return public_key.public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.iterations)
@@ -0,0 +1,262 @@
+"""
+Нагрузочный прогон эндпоинтов в одном процессе (ASGI-транспорт httpx, без сети).
+
+Сценарии: login, me (чтение с токеном), products (список), product_crud
+(создание/обновление/удаление), users_list (GET /users/all админом).
+По каждому - пропускная способность, p50/p95/p99 и ошибки.
+
+Запуск:
+    python benchmarks/loadtest.py                                  # временная SQLite
+    python benchmarks/loadtest.py --database-url postgresql://u:p@localhost/loadtest_db
+    python benchmarks/loadtest.py --concurrency 32 --requests 2000 --users 1000 --json results.json
+    python benchmarks/loadtest.py --scenarios me,products --compare results_before.json
+
+БД должна быть одноразовой: скрипт создает схему и тестовые данные (пользователи loadtest_*).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+SCENARIOS = ("login", "me", "products", "product_crud", "users_list")
+PASSWORD = "loadtest-password"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", help="по умолчанию временная SQLite")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="запросов на сценарий")
+    parser.add_argument("--login-requests", type=int, default=100, help="логин упирается в bcrypt - меньше запросов")
+    parser.add_argument("--users", type=int, default=200, help="пользователей в наборе данных")
+    parser.add_argument("--products-per-user", type=int, default=10)
+    parser.add_argument("--bcrypt-rounds", type=int, help="BCRYPT_ROUNDS для прогона (по умолчанию из окружения)")
+    parser.add_argument("--async-db", action="store_true", help="DB_ASYNC=1 (asyncpg/aiosqlite)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="файл для результатов в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    return parser.parse_args()
+
+
+def configure_environment(args) -> str:
+    # До импорта приложения: настройки читаются из окружения при импорте
+    url = args.database_url
+    if not url:
+        path = Path(tempfile.mkdtemp(prefix="loadtest_")) / "loadtest.db"
+        url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["DB_ASYNC"] = "1" if args.async_db else "0"
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    # Вся нагрузка идет с одного адреса - лимиты логина отключаем
+    os.environ.setdefault("LOGIN_IP_LIMIT", "0")
+    os.environ.setdefault("LOGIN_EMAIL_LIMIT", "0")
+    # Очередь хеширования не должна отказывать генератору нагрузки
+    os.environ.setdefault("PASSWORD_HASH_QUEUE_DEPTH", str(max(args.concurrency * 2, 64)))
+    return url
+
+
+def seed(users: int, products_per_user: int) -> List[str]:
+    """Схема, роли и набор данных; пароли одинаковые, хеш считается один раз"""
+    from sqlalchemy import insert, select
+    from database.db import SessionLocal
+    from models.product import Product
+    from models.role import Role
+    from models.user import User
+    from services.init_roles import bootstrap
+    from services.user_provisioning import upsert_users
+    from utils.security import hash_password
+
+    bootstrap()
+    hashed = hash_password(PASSWORD)
+    emails = [f"loadtest_{i}@example.com" for i in range(users)]
+    db = SessionLocal()
+    try:
+        role_id = db.scalar(select(Role.id).where(Role.name == "user"))
+        upsert_users(db, [
+            {"first_name": "Load", "last_name": str(i), "email": email, "hashed_password": hashed,
+             "role_id": role_id, "is_active": True}
+            for i, email in enumerate(emails)
+        ])
+        user_ids = db.scalars(select(User.id).where(User.email.in_(emails))).all()
+        if products_per_user:
+            db.execute(insert(Product), [
+                {"name": f"product {n}", "description": "loadtest", "owner_id": user_id}
+                for user_id in user_ids for n in range(products_per_user)
+            ])
+        db.commit()
+    finally:
+        db.close()
+    return emails
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank: наименьшее значение, не меньше которого q% выборки; монотонно по q"""
+    if not sorted_values:
+        return 0.0
+    index = min(math.ceil(q / 100 * len(sorted_values)) - 1, len(sorted_values) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def summarize(timings: List[float], statuses: Dict[int, int], elapsed: float) -> dict:
+    timings.sort()
+    count = len(timings)
+    return {
+        "requests": count,
+        "errors": sum(n for status, n in statuses.items() if status >= 400),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "throughput_rps": count / elapsed if elapsed else 0.0,
+        "mean_ms": sum(timings) / count * 1000 if count else 0.0,
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p95_ms": percentile(timings, 95) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+    }
+
+
+async def run_scenario(total: int, concurrency: int, operation: Callable) -> Dict[str, dict]:
+    """concurrency воркеров выполняют total операций; операция может сделать несколько запросов"""
+    timings: Dict[str, List[float]] = {}
+    statuses: Dict[str, Dict[int, int]] = {}
+    remaining = iter(range(total))
+
+    async def record(name: str, request):
+        started = time.perf_counter()
+        response = await request
+        timings.setdefault(name, []).append(time.perf_counter() - started)
+        by_status = statuses.setdefault(name, {})
+        by_status[response.status_code] = by_status.get(response.status_code, 0) + 1
+        return response
+
+    async def worker(rng: random.Random):
+        for _ in remaining:
+            await operation(record, rng)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(random.Random(n)) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {name: summarize(timings[name], statuses[name], elapsed) for name in timings}
+
+
+async def run(args, emails: List[str]) -> Dict[str, dict]:
+    import httpx
+    from main import app
+    from services.startup import warm_up
+
+    warm_up()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        # Токены заранее: сценарии чтения не должны мерить bcrypt
+        tokens = []
+        for email in emails[:max(args.concurrency, 1)]:
+            response = await client.post("/auth/auth/login", json={"email": email, "password": PASSWORD})
+            tokens.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+        admin = await client.post("/auth/auth/login", json={"email": "admin@example.com", "password": "admin123"})
+        admin_headers = {"Authorization": f"Bearer {admin.json()['access_token']}"}
+
+        async def login(record, rng):
+            email = rng.choice(emails)
+            await record("login", client.post("/auth/auth/login", json={"email": email, "password": PASSWORD}))
+
+        async def me(record, rng):
+            await record("me", client.get("/users/me", headers=rng.choice(tokens)))
+
+        async def products(record, rng):
+            await record("products", client.get("/resource/products", headers=rng.choice(tokens)))
+
+        async def product_crud(record, rng):
+            headers = rng.choice(tokens)
+            response = await record("product_create", client.post(
+                "/resource/products", headers=headers, json={"name": "crud", "description": "loadtest"}))
+            product_id = response.json()["id"]
+            await record("product_update", client.put(
+                f"/resource/products/{product_id}", headers=headers, json={"name": "crud updated"}))
+            await record("product_delete", client.delete(f"/resource/products/{product_id}", headers=headers))
+
+        async def users_list(record, rng):
+            after_id = rng.randint(0, len(emails))
+            await record("users_list", client.get(f"/users/all?after_id={after_id}&limit=100", headers=admin_headers))
+
+        operations = {"login": login, "me": me, "products": products,
+                      "product_crud": product_crud, "users_list": users_list}
+        results = {}
+        for name in args.scenarios.split(","):
+            total = args.login_requests if name == "login" else args.requests
+            results.update(await run_scenario(total, args.concurrency, operations[name]))
+        return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results: Dict[str, dict], baseline: Dict[str, dict]):
+    print(f"{'endpoint':<16} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, result in results.items():
+        line = (f"{name:<16} {result['throughput_rps']:8.1f} {result['p50_ms']:8.2f} "
+                f"{result['p95_ms']:8.2f} {result['p99_ms']:8.2f} {result['errors']:7d}")
+        before = baseline.get(name)
+        if before and before["p95_ms"]:
+            line += f"   p95 {(result['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%"
+            line += f", rps {(result['throughput_rps'] / before['throughput_rps'] - 1) * 100:+.0f}%"
+        print(line)
+
+
+def main():
+    args = parse_args()
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    url = configure_environment(args)
+    random.seed(args.seed)
+
+    emails = seed(args.users, args.products_per_user)
+    results = asyncio.run(run(args, emails))
+
+    from database.db import engine
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "dialect": engine.dialect.name,
+            "async_db": args.async_db,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "users": args.users,
+            "products_per_user": args.products_per_user,
+            "bcrypt_rounds": int(os.getenv("BCRYPT_ROUNDS", "12")),
+        },
+        "results": results,
+    }
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    print(f"{report['meta']['revision']} {report['meta']['dialect']} concurrency={args.concurrency}")
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if url.startswith("sqlite"):
+        print(f"database: {url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import threading
+import time
+
+
+class PoolMetrics:
+    """Счетчики пула соединений: выдачи, ожидание соединения, переподключения"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checkout_errors = 0
+        self.checkout_wait_seconds = 0.0
+        self.checkout_wait_max_seconds = 0.0
+        self.connects = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, wait_seconds: float, failed: bool = False):
+        with self._lock:
+            if failed:
+                self.checkout_errors += 1
+                return
+            self.checkouts += 1
+            self.checkout_wait_seconds += wait_seconds
+            if wait_seconds > self.checkout_wait_max_seconds:
+                self.checkout_wait_max_seconds = wait_seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "checkout_errors": self.checkout_errors,
+            "checkout_wait_seconds_total": self.checkout_wait_seconds,
+            "checkout_wait_seconds_max": self.checkout_wait_max_seconds,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+        }
+
+
+def pool_gauges(pool) -> dict:
+    # size/checkedout/overflow есть только у QueuePool
+    if not hasattr(pool, "checkedout"):
+        return {}
+    return {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+
+
+pool_metrics = PoolMetrics()
+
+
+def instrumented(pool_class):
+    """Подкласс пула, который замеряет время ожидания соединения"""
+
+    class InstrumentedPool(pool_class):
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                connection = super().connect()
+            except Exception:
+                pool_metrics.record_checkout(time.perf_counter() - started, failed=True)
+                raise
+            pool_metrics.record_checkout(time.perf_counter() - started)
+            return connection
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+
+def attach_pool_events(engine):
+    from sqlalchemy import event
+
+    def on_connect(dbapi_connection, connection_record):
+        with pool_metrics._lock:
+            pool_metrics.connects += 1
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with pool_metrics._lock:
+            pool_metrics.invalidations += 1
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "invalidate", on_invalidate)
@@ -1,20 +1,65 @@
-from fastapi import FastAPI
-from routes.auth import router as auth_router
-from routes.resource_router import router as resource_router
-from routes.user_router import router as user_router
+from services.startup import STARTUP_PROFILE, readiness, retry_warm_up, startup_profile, warm_up
+
+if STARTUP_PROFILE:
+    # STARTUP_PROFILE=1: время импорта каждого модуля и шагов прогрева выводится при старте
+    startup_profile.install()
+
+import sys
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from middlewares.auth_middleware import AuthMiddleware
-from database.db import Base, engine
+from middlewares.metrics_middleware import MetricsMiddleware
+from middlewares.query_audit_middleware import QueryAuditMiddleware
+from services.metrics import CONTENT_TYPE, METRICS_ENABLED, registry
+from services.query_audit import QUERY_AUDIT, attach_audit_events
+from services.password_hasher import PasswordHasherBusy, PASSWORD_HASH_RETRY_AFTER
+from database.db import DB_ASYNC
 import models.user
 import models.role
 import models.product
 import models.access_roles_rules
+import models.refresh_token
+import models.revoked_token
+import models.email_change
 from fastapi.openapi.utils import get_openapi
 
-# создаем таблицы
-Base.metadata.create_all(bind=engine)
+if DB_ASYNC:
+    from routes.auth_async import router as auth_router
+    from routes.resource_router_async import router as resource_router
+    from routes.user_router_async import router as user_router
+else:
+    from routes.auth import router as auth_router
+    from routes.resource_router import router as resource_router
+    from routes.user_router import router as user_router
 
 app = FastAPI(title="Auth System Project")
 app.add_middleware(AuthMiddleware)
+if QUERY_AUDIT:
+    attach_audit_events()
+    app.add_middleware(QueryAuditMiddleware)
+if METRICS_ENABLED:
+    # Добавлен последним - внешний слой, в замер попадает и аутентификация
+    app.add_middleware(MetricsMiddleware)
+
+
+@app.on_event("startup")
+def startup():
+    # Прогрев (bcrypt, права, отзывы) до приема трафика; при ошибке повторяется в /health/ready
+    warm_up()
+    if STARTUP_PROFILE:
+        startup_profile.uninstall()
+        print(startup_profile.report(), file=sys.stderr)
+
+
+@app.exception_handler(PasswordHasherBusy)
+def password_hasher_busy(request: Request, exc: PasswordHasherBusy):
+    # Пул bcrypt переполнен - быстро отказываем, чтобы не копить очередь логинов
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+    )
+
 
 app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 app.include_router(user_router, prefix="/users", tags=["Users"])
@@ -24,6 +69,25 @@ app.include_router(resource_router, prefix="/resource", tags=["Resource"])
 def read_root():
     return {"message": "Auth System API"}
 
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        # Формат Prometheus text exposition
+        return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/health/live", include_in_schema=False)
+def liveness():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", include_in_schema=False)
+def readiness_probe():
+    if not readiness.ready:
+        retry_warm_up()
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.status())
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
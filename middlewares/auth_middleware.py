@@ -1,26 +1,77 @@
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from sqlalchemy.orm import Session, joinedload
+import time
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Receive, Scope, Send
+from database.db import DB_ASYNC
 from utils.security import decode_access_token
-from models.user import User
-from database.db import SessionLocal
-
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        token = request.headers.get("Authorization")
-        request.state.user = None
-        if token and token.startswith("Bearer "):
-            token_value = token[7:]
-            payload = decode_access_token(token_value)
-            if payload:
-                user_id = payload.get("user_id")
-                db: Session = SessionLocal()
-                try:
-                    # Используем joinedload для загрузки роли вместе с пользователем
-                    user = db.query(User).options(joinedload(User.role)).filter(User.id == user_id).first()
-                    if user and user.is_active:
-                        request.state.user = user
-                finally:
-                    db.close()
-        response = await call_next(request)
-        return response
\ No newline at end of file
+from services.principal_cache import fetch_principal, fetch_principal_async, get_cached_principal, principal_cache
+from services.auth_tokens import revocation_list
+from services.metrics import PRINCIPAL_FETCH_SECONDS
+
+# Эндпоинты, которым не нужен пользователь - токен для них не разбираем
+PUBLIC_PATHS = {"/", "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json", "/metrics"}
+PUBLIC_PREFIXES = ("/auth/", "/health/")
+
+
+def is_public_path(path: str) -> bool:
+    return path in PUBLIC_PATHS or path.startswith(PUBLIC_PREFIXES)
+
+
+def get_bearer_token(scope: Scope):
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            if value.startswith(b"Bearer "):
+                return value[7:].decode("latin-1")
+            return None
+    return None
+
+
+class AuthMiddleware:
+    """ASGI middleware: кладет аутентифицированного пользователя в request.state.user"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+        state["user"] = None
+        state["token"] = None
+        if not is_public_path(scope["path"]):
+            await self.authenticate(scope, state)
+
+        await self.app(scope, receive, send)
+
+    async def authenticate(self, scope: Scope, state: dict):
+        token = get_bearer_token(scope)
+        if not token:
+            return
+        payload = decode_access_token(token)
+        if not payload or payload.get("type") == "refresh":
+            return
+
+        # Список отзывов в памяти; изредка догружаем отзывы других процессов
+        if revocation_list.sync_due():
+            await run_in_threadpool(revocation_list.sync)
+        if revocation_list.is_revoked(payload.get("jti")):
+            return
+
+        user_id, issued_at = payload.get("user_id"), payload.get("iat")
+        user = get_cached_principal(user_id, issued_at, remote=False)
+        if user is None and principal_cache.backend is not None:
+            # Общий L2 - сетевой запрос, из event loop уводим
+            user = await run_in_threadpool(get_cached_principal, user_id, issued_at)
+        if user is None:
+            started = time.perf_counter()
+            if DB_ASYNC:
+                user = await fetch_principal_async(user_id)
+            else:
+                # Синхронный запрос к БД уводим из event loop
+                user = await run_in_threadpool(fetch_principal, user_id)
+            PRINCIPAL_FETCH_SECONDS.observe(time.perf_counter() - started)
+        if user and user.is_active:
+            state["user"] = user
+            state["token"] = payload
@@ -1,34 +1,115 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
+from database.db import SessionLocal
 from models.access_roles_rules import AccessRolesRules
+from services.metrics import PERMISSION_MATRIX_LOADS
+from services.shared_cache import invalidation_bus
 
+# Порядок битов в маске прав: action -> бит
+PERMISSION_ACTIONS = (
+    "read",
+    "read_all",
+    "create",
+    "update",
+    "update_all",
+    "delete",
+    "delete_all",
+)
+PERMISSION_BITS = {action: 1 << i for i, action in enumerate(PERMISSION_ACTIONS)}
 
-def check_permission(user, element: str, action: str, db: Session):
-    # admin все может
-    if user.role.name == "admin":
-        return True
+# Как часто перечитывать правила из БД, если их поменял другой процесс (init_db.py и т.п.)
+PERMISSIONS_REFRESH_SECONDS = 30
 
-    # Ищем правила для роли пользователя и элемента
-    rule = db.query(AccessRolesRules).filter(
-        AccessRolesRules.role_id == user.role_id,
-        AccessRolesRules.element == element
-    ).first()
 
-    if not rule:
-        raise HTTPException(status_code=403, detail="Access denied")
+def rule_to_mask(rule: AccessRolesRules) -> int:
+    mask = 0
+    for action, bit in PERMISSION_BITS.items():
+        if getattr(rule, f"{action}_permission"):
+            mask |= bit
+    return mask
+
+
+class PermissionMatrix:
+    """Кэш правил доступа: (role_id, element) -> битовая маска прав"""
+
+    def __init__(self, refresh_seconds: float = PERMISSIONS_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.version = 0
+        self._masks: Dict[Tuple[int, str], int] = {}
+        self._loaded_version = -1
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self, db: Optional[Session] = None) -> None:
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            version = self.version
+            masks = {
+                (rule.role_id, rule.element): rule_to_mask(rule)
+                for rule in db.query(AccessRolesRules).all()
+            }
+        finally:
+            if own_session:
+                db.close()
+
+        PERMISSION_MATRIX_LOADS.inc()
+        with self._lock:
+            self._masks = masks
+            self._loaded_version = version
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        # Новая версия -> при следующей проверке матрица будет перечитана
+        with self._lock:
+            self.version += 1
+
+    def is_stale(self) -> bool:
+        return (
+            self._loaded_version != self.version
+            or time.monotonic() - self._loaded_at > self.refresh_seconds
+        )
+
+    def get_mask(self, role_id: int, element: str, db: Optional[Session] = None) -> int:
+        if self.is_stale():
+            self.load(db)
+        return self._masks.get((role_id, element), 0)
+
+
+permission_matrix = PermissionMatrix()
+
+
+def invalidate_permissions():
+    permission_matrix.invalidate()
+    invalidation_bus.publish("permissions")
+
+
+# Правила изменены в другом процессе - перечитываем при следующей проверке
+invalidation_bus.on("permissions", lambda key: permission_matrix.invalidate())
+
+
+async def refresh_permissions_async(db):
+    # Для AsyncSession: перечитываем матрицу заранее, чтобы check_permission не ходил в БД синхронно
+    if permission_matrix.is_stale():
+        await db.run_sync(permission_matrix.load)
+
+
+def has_permission(user, element: str, action: str, db: Optional[Session] = None) -> bool:
+    # Право на все строки (read_all и т.п.) включает право на свои
+    bit = PERMISSION_BITS.get(action)
+    if bit is None:
+        return False
+    bit |= PERMISSION_BITS.get(f"{action}_all", 0)
+    return bool(permission_matrix.get_mask(user.role_id, element, db) & bit)
+
 
-    # Проверяем конкретное разрешение
-    permission_map = {
-        "read": rule.read_permission,
-        "read_all": rule.read_all_permission,
-        "create": rule.create_permission,
-        "update": rule.update_permission,
-        "update_all": rule.update_all_permission,
-        "delete": rule.delete_permission,
-        "delete_all": rule.delete_all_permission,
-    }
-
-    if action not in permission_map or not permission_map[action]:
+def check_permission(user, element: str, action: str, db: Optional[Session] = None):
+    if not has_permission(user, element, action, db):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,55 @@
+import time
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+from services.metrics import (
+    HTTP_REQUEST_DB_QUERIES, HTTP_REQUEST_DB_SECONDS, HTTP_REQUEST_SECONDS, request_db_stats,
+)
+
+# Запросы мимо роутов складываем в одну серию, чтобы не плодить метки по произвольным путям
+UNMATCHED_ROUTE = "unmatched"
+
+
+def route_template(scope: Scope) -> str:
+    """Шаблон пути (/products/{product_id}) по endpoint-у, который выбрал роутер"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED_ROUTE
+    app = scope.get("app")
+    paths = getattr(app, "_metrics_route_paths", None)
+    if paths is None or endpoint not in paths:
+        paths = {getattr(route, "endpoint", None): route.path for route in getattr(app, "routes", ())}
+        setattr(app, "_metrics_route_paths", paths)
+    return paths.get(endpoint, UNMATCHED_ROUTE)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: латентность по роутам и число/время запросов к БД на HTTP-запрос"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = [0, 0.0]
+        token = request_db_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            request_db_stats.reset(token)
+            method, route = scope["method"], route_template(scope)
+            HTTP_REQUEST_SECONDS.observe(duration, method, route, status)
+            HTTP_REQUEST_DB_QUERIES.observe(stats[0], method, route)
+            HTTP_REQUEST_DB_SECONDS.observe(stats[1], method, route)
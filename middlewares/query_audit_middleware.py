@@ -0,0 +1,23 @@
+from starlette.types import ASGIApp, Receive, Scope, Send
+from middlewares.metrics_middleware import route_template
+from services.query_audit import QueryAudit, current_audit, report
+
+
+class QueryAuditMiddleware:
+    """ASGI middleware (QUERY_AUDIT=1): пишет в лог N+1, медленные запросы и превышение бюджета"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        audit = QueryAudit()
+        token = current_audit.set(audit)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_audit.reset(token)
+            report(scope["method"], route_template(scope), audit)
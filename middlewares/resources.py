@@ -0,0 +1,126 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from sqlalchemy import event, true
+from sqlalchemy.orm import ORMExecuteState, Session, with_loader_criteria
+from starlette.concurrency import run_in_threadpool
+from database.db import DB_ASYNC, get_async_sessionmaker
+from middlewares.authorization import PERMISSION_BITS, permission_matrix, refresh_permissions_async
+from models.product import Product
+from models.user import User
+
+BASE_ACTIONS = ("read", "create", "update", "delete")
+
+
+class Resource:
+    """Защищаемый элемент: имя в access_roles_rules, действия и колонка владельца.
+
+    Для каждого действия заранее считаются биты "свои" и "все"; без колонки владельца
+    (или для create) право на действие распространяется на все строки.
+    """
+
+    def __init__(self, element: str, owner_column=None, actions: Tuple[str, ...] = BASE_ACTIONS):
+        self.element = element
+        self.owner_column = owner_column
+        self.actions = tuple(actions)
+        self.bits: Dict[str, Tuple[int, int]] = {}
+        for action in self.actions:
+            scoped = owner_column is not None and f"{action}_all" in PERMISSION_BITS
+            own_bit = PERMISSION_BITS[action]
+            self.bits[action] = (own_bit, PERMISSION_BITS[f"{action}_all"] if scoped else own_bit)
+
+    @property
+    def model(self):
+        return self.owner_column.class_ if self.owner_column is not None else None
+
+    @property
+    def permissions(self) -> set:
+        # Имена прав (колонок правила), которые имеют смысл для элемента
+        return {name for action in self.actions for name in PERMISSION_BITS
+                if PERMISSION_BITS[name] in self.bits[action]}
+
+    def grant(self, user, action: str, db: Optional[Session] = None) -> Optional["Grant"]:
+        """Разрешение пользователю на действие: на все строки, только на свои или None"""
+        own_bit, all_bit = self.bits[action]
+        # Роль admin не особенная: ее права - такие же правила в access_roles_rules
+        mask = permission_matrix.get_mask(user.role_id, self.element, db)
+        if mask & all_bit:
+            return Grant(self, user, action, True)
+        if mask & own_bit:
+            return Grant(self, user, action, False)
+        return None
+
+
+@dataclass(frozen=True)
+class Grant:
+    resource: Resource
+    user: Any
+    action: str
+    scope_all: bool
+
+    def where(self):
+        """Условие WHERE: все строки или только строки пользователя"""
+        if self.scope_all:
+            return true()
+        return self.resource.owner_column == self.user.id
+
+    def allows(self, owner_id: Optional[int]) -> bool:
+        return self.scope_all or owner_id == self.user.id
+
+    def scope(self, statement):
+        """SELECT, который при выполнении ограничится строками пользователя (см. apply_row_scope)"""
+        return statement.execution_options(grant=self)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def apply_row_scope(state: ORMExecuteState):
+    # Фильтр по владельцу добавляется в SQL ко всем вхождениям модели ресурса, включая JOIN и подзапросы
+    grant = state.execution_options.get("grant")
+    if grant is None or grant.scope_all or not state.is_select or state.is_column_load:
+        return
+    state.statement = state.statement.options(with_loader_criteria(
+        grant.resource.model, grant.where(), include_aliases=True
+    ))
+
+
+resources: Dict[str, Resource] = {}
+
+
+def register_resource(resource: Resource) -> Resource:
+    resources[resource.element] = resource
+    return resource
+
+
+USERS = register_resource(Resource("users", User.id))
+PRODUCTS = register_resource(Resource("products", Product.owner_id))
+
+
+async def refresh_permissions():
+    # Перечитывание правил - запрос к БД, из event loop уводим
+    if not permission_matrix.is_stale():
+        return
+    if DB_ASYNC:
+        async with get_async_sessionmaker()() as db:
+            await refresh_permissions_async(db)
+    else:
+        await run_in_threadpool(permission_matrix.load)
+
+
+def require(element: str, action: str) -> Callable:
+    """Зависимость FastAPI: Depends(require("products", "update")) возвращает Grant или 403"""
+    resource = resources[element]
+    if action not in resource.bits:
+        raise ValueError(f"{element} has no action {action!r}")
+
+    async def dependency(request: Request) -> Grant:
+        user = request.state.user
+        if not user:
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        await refresh_permissions()
+        grant = resource.grant(user, action)
+        if grant is None:
+            raise HTTPException(status_code=403, detail="Access denied")
+        return grant
+
+    return dependency
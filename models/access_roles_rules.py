@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Boolean, ForeignKey, String
+from sqlalchemy import Column, Integer, Boolean, ForeignKey, String, Index
 from database.db import Base
 
 class AccessRolesRules(Base):
@@ -13,4 +13,9 @@ class AccessRolesRules(Base):
     update_permission = Column(Boolean, default=False)
     update_all_permission = Column(Boolean, default=False)
     delete_permission = Column(Boolean, default=False)
-    delete_all_permission = Column(Boolean, default=False)
\ No newline at end of file
+    delete_all_permission = Column(Boolean, default=False)
+
+    __table_args__ = (
+        # Одно правило на пару (роль, элемент) - по нему идет upsert при bootstrap
+        Index("uq_access_roles_rules_role_element", "role_id", "element", unique=True),
+    )
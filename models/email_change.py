@@ -0,0 +1,12 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime
+from database.db import Base
+
+class EmailChange(Base):
+    """Смены email: по ним фильтры email в других процессах догружают новые адреса"""
+    __tablename__ = "email_changes"
+
+    id = Column(Integer, primary_key=True)
+    email = Column(String, nullable=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database.db import Base
 
@@ -10,4 +10,9 @@ class Product(Base):
     description = Column(String, default="")
     owner_id = Column(Integer, ForeignKey("users.id"))
 
-    owner = relationship("User")
\ No newline at end of file
+    owner = relationship("User")
+
+    __table_args__ = (
+        # Список своих продуктов: WHERE owner_id = ? AND id > ? ORDER BY id
+        Index("ix_products_owner_id_id", "owner_id", "id"),
+    )
\ No newline at end of file
@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from database.db import Base
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String, nullable=False, unique=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 from database.db import Base
 
@@ -13,4 +13,22 @@ class User(Base):
     role_id = Column(Integer, ForeignKey('roles.id'))
     is_active = Column(Boolean, default=True)
 
-    role = relationship("Role", backref="users")
\ No newline at end of file
+    role = relationship("Role", backref="users")
+
+    __table_args__ = (
+        # Фильтр по роли + keyset-пагинация по id
+        Index("ix_users_role_id_id", "role_id", "id"),
+        # Поиск по префиксу email (LIKE 'abc%') независимо от collation
+        Index("ix_users_email_pattern", "email", postgresql_ops={"email": "text_pattern_ops"}),
+        # Поиск по email без учета регистра: WHERE lower(email) = :email; заодно запрещает
+        # адреса, отличающиеся только регистром
+        Index("uq_users_email_lower", func.lower(email), unique=True),
+    )
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def email_equals(email: str):
+    return func.lower(User.email) == normalize_email(email)
\ No newline at end of file
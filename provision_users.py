@@ -0,0 +1,49 @@
+"""
+Массовое создание пользователей из CSV или NDJSON.
+
+Колонки/поля: first_name, last_name, email, password, role (по умолчанию user).
+Уже существующие email пропускаются, поэтому файл можно прогонять повторно.
+
+Запуск:
+    python provision_users.py users.csv
+    python provision_users.py users.ndjson --batch-size 2000 --workers 8
+    cat users.ndjson | python provision_users.py - --format ndjson
+"""
+import argparse
+import sys
+
+from services.user_provisioning import (
+    PROVISION_BATCH_SIZE, PROVISION_WORKERS, UserProvisioner, iter_records, make_executor, print_progress,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk user provisioning")
+    parser.add_argument("path", help="CSV/NDJSON файл или - для stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="по умолчанию по расширению файла")
+    parser.add_argument("--batch-size", type=int, default=PROVISION_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=PROVISION_WORKERS)
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    parser.add_argument("--role", default="user", help="роль для записей без колонки role")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    stream = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    try:
+        with make_executor(args.executor, args.workers) as executor:
+            provisioner = UserProvisioner(executor, batch_size=args.batch_size,
+                                          default_role=args.role, on_progress=print_progress)
+            stats = provisioner.run(iter_records(stream, fmt))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+    print(file=sys.stderr)
+    for error in stats.errors:
+        print(error, file=sys.stderr)
+    print(f"Done in {stats.elapsed:.1f}s: {stats}")
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request
 from pydantic import BaseModel, EmailStr
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from models.user import User
+from models.user import User, email_equals, normalize_email
 from models.role import Role
-from utils.security import hash_password, verify_password, create_access_token
+from utils.security import password_needs_update
+from services.password_hasher import password_hasher
+from services.user_service import rehash_user_password
+from services.auth_tokens import issue_token_pair, rotate_refresh_token
+from services.rate_limiter import enforce_login_limits
+from services.email_filter import email_filter
 from database.db import get_db
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -20,13 +26,17 @@ class LoginSchema(BaseModel):
     email: EmailStr
     password: str
 
+class RefreshSchema(BaseModel):
+    refresh_token: str
+
 # ---------------- Routes ----------------
 @router.post("/register")
 def register_user(data: RegisterSchema, db: Session = Depends(get_db)):
-    # Проверка, что email ещё не зарегистрирован
-    existing_user = db.query(User).filter(User.email == data.email).first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
+    # Проверка, что email ещё не зарегистрирован; для заведомо нового email запрос не нужен
+    if email_filter.might_exist(data.email):
+        existing_user = db.query(User.id).filter(email_equals(data.email)).first()
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Email already registered")
 
     # Проверка роли
     role = db.query(Role).filter(Role.id == data.role_id).first()
@@ -37,26 +47,53 @@ def register_user(data: RegisterSchema, db: Session = Depends(get_db)):
     new_user = User(
         first_name=data.first_name,
         last_name=data.last_name,
-        email=data.email,
-        hashed_password=hash_password(data.password),
+        email=normalize_email(data.email),
+        hashed_password=password_hasher.hash(data.password),
         role_id=data.role_id
     )
 
     db.add(new_user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Фильтр другого процесса еще не знал об этом email - сработало ограничение unique
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
     db.refresh(new_user)
+    email_filter.add(new_user.email)
 
     return {"id": new_user.id, "email": new_user.email, "role_id": new_user.role_id}
 
 
 @router.post("/login")
-def login(data: LoginSchema, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == data.email).first()
-    if not user or not verify_password(data.password, user.hashed_password):
+def login(data: LoginSchema, request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    # Лимит попыток проверяется до запроса к БД и bcrypt
+    enforce_login_limits(request, data.email)
+    # Неизвестный email: без запроса к БД, но с проверкой пароля той же стоимости
+    user = None
+    if email_filter.may_exist(data.email, db):
+        user = db.query(User).filter(email_equals(data.email)).first()
+    if not user:
+        password_hasher.dummy_verify(data.password)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if not password_hasher.verify(data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     if not user.is_active:
         raise HTTPException(status_code=401, detail="Account deactivated")
 
-    token = create_access_token({"user_id": user.id})
-    return {"access_token": token, "token_type": "bearer"}
\ No newline at end of file
+    # Хеш по устаревшей схеме/стоимости - обновляем уже после отправки ответа
+    if password_needs_update(user.hashed_password):
+        background_tasks.add_task(rehash_user_password, user.id, user.hashed_password, data.password)
+
+    tokens = issue_token_pair(db, user.id)
+    db.commit()
+    return tokens
+
+
+@router.post("/refresh")
+def refresh(data: RefreshSchema, db: Session = Depends(get_db)):
+    # Старый refresh-токен отзывается, взамен выдается новая пара
+    tokens = rotate_refresh_token(db, data.refresh_token)
+    db.commit()
+    return tokens
\ No newline at end of file
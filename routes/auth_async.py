@@ -0,0 +1,86 @@
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.user import User, email_equals, normalize_email
+from models.role import Role
+from utils.security import password_needs_update
+from services.password_hasher import password_hasher
+from services.user_service import rehash_user_password
+from services.auth_tokens import issue_token_pair, rotate_refresh_token
+from services.rate_limiter import enforce_login_limits_async
+from services.email_filter import email_filter
+from database.db import get_async_db
+from routes.auth import RegisterSchema, LoginSchema, RefreshSchema
+
+# Асинхронные версии эндпоинтов routes/auth.py (DB_ASYNC=1)
+router = APIRouter(prefix="/auth", tags=["Auth"])
+
+
+@router.post("/register")
+async def register_user(data: RegisterSchema, db: AsyncSession = Depends(get_async_db)):
+    # Проверка, что email ещё не зарегистрирован; для заведомо нового email запрос не нужен
+    if email_filter.might_exist(data.email):
+        existing_user = await db.scalar(select(User.id).where(email_equals(data.email)))
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Email already registered")
+
+    # Проверка роли
+    role = await db.scalar(select(Role.id).where(Role.id == data.role_id))
+    if not role:
+        raise HTTPException(status_code=400, detail="Role does not exist")
+
+    # bcrypt выполняется в отдельном пуле, event loop не блокируется
+    new_user = User(
+        first_name=data.first_name,
+        last_name=data.last_name,
+        email=normalize_email(data.email),
+        hashed_password=await password_hasher.hash_async(data.password),
+        role_id=data.role_id
+    )
+
+    db.add(new_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Фильтр другого процесса еще не знал об этом email - сработало ограничение unique
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
+    email_filter.add(new_user.email)
+
+    return {"id": new_user.id, "email": new_user.email, "role_id": new_user.role_id}
+
+
+@router.post("/login")
+async def login(data: LoginSchema, request: Request, background_tasks: BackgroundTasks,
+                db: AsyncSession = Depends(get_async_db)):
+    # Лимит попыток проверяется до запроса к БД и bcrypt
+    await enforce_login_limits_async(request, data.email)
+    # Неизвестный email: без запроса к БД, но с проверкой пароля той же стоимости
+    user = None
+    if await email_filter.may_exist_async(data.email, db):
+        user = await db.scalar(select(User).where(email_equals(data.email)))
+    if not user:
+        await password_hasher.dummy_verify_async(data.password)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if not await password_hasher.verify_async(data.password, user.hashed_password):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    if not user.is_active:
+        raise HTTPException(status_code=401, detail="Account deactivated")
+
+    # Хеш по устаревшей схеме/стоимости - обновляем уже после отправки ответа
+    if password_needs_update(user.hashed_password):
+        background_tasks.add_task(rehash_user_password, user.id, user.hashed_password, data.password)
+
+    tokens = await db.run_sync(issue_token_pair, user.id)
+    await db.commit()
+    return tokens
+
+
+@router.post("/refresh")
+async def refresh(data: RefreshSchema, db: AsyncSession = Depends(get_async_db)):
+    # Старый refresh-токен отзывается, взамен выдается новая пара
+    tokens = await db.run_sync(rotate_refresh_token, data.refresh_token)
+    await db.commit()
+    return tokens
@@ -1,15 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import List, Optional
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from database.db import get_db
-from models.user import User
 from models.product import Product
-from middlewares.authorization import check_permission
-from pydantic import BaseModel
+from middlewares.resources import Grant, require
+from services.principal_cache import Principal
+from utils.export import ExportFormat, export_response
+from utils.pagination import keyset_page
+from services import product_batch, product_service
+from pydantic import BaseModel, conlist
 
 router = APIRouter()
 
 
-def get_current_user(request: Request) -> User:
+def get_current_user(request: Request) -> Principal:
     user = request.state.user
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -21,34 +26,130 @@ class ProductSchema(BaseModel):
     description: str = ""
 
 
-@router.get("/products")
+class ProductOut(BaseModel):
+    id: int
+    name: str
+    description: Optional[str]
+    owner_id: Optional[int]
+
+    class Config:
+        orm_mode = True
+
+
+# ---------------- Batch ----------------
+BATCH_MAX_ITEMS = 10_000
+
+
+class ProductUpdateItem(ProductSchema):
+    id: int
+
+
+class ProductBatchCreate(BaseModel):
+    items: conlist(ProductSchema, min_items=1, max_items=BATCH_MAX_ITEMS)
+
+
+class ProductBatchUpdate(BaseModel):
+    items: conlist(ProductUpdateItem, min_items=1, max_items=BATCH_MAX_ITEMS)
+
+
+class ProductBatchDelete(BaseModel):
+    ids: conlist(int, min_items=1, max_items=BATCH_MAX_ITEMS)
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    id: Optional[int]
+    status: int
+    detail: str
+
+
+class BatchResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]
+
+
+PRODUCTS_PAGE_DEFAULT_LIMIT = 100
+PRODUCTS_PAGE_MAX_LIMIT = 1000
+# Только колонки таблицы: связь owner при выдаче списка не трогается
+PRODUCT_COLUMNS = (Product.id, Product.name, Product.description, Product.owner_id)
+
+
+class ProductPage:
+    """Параметры списка продуктов: keyset-пагинация по id или потоковая выгрузка"""
+
+    def __init__(
+        self,
+        after_id: Optional[int] = None,
+        limit: int = Query(PRODUCTS_PAGE_DEFAULT_LIMIT, ge=1, le=PRODUCTS_PAGE_MAX_LIMIT),
+        export_format: Optional[ExportFormat] = Query(None, alias="format"),
+    ):
+        self.after_id = after_id
+        self.limit = limit
+        self.export_format = export_format
+
+    def query(self, grant: Grant):
+        # Если есть право читать все, показываем все продукты, иначе только свои - фильтр добавит SQL-слой
+        query = grant.scope(select(*PRODUCT_COLUMNS))
+        if self.after_id is not None:
+            query = query.where(Product.id > self.after_id)
+        return query.order_by(Product.id)
+
+    def build(self, rows, response: Response) -> list:
+        return keyset_page(rows, self.limit, response)
+
+
+@router.get("/products", response_model=List[ProductOut])
 def get_products(
-        current_user: User = Depends(get_current_user),
+        response: Response,
+        page: ProductPage = Depends(),
+        grant: Grant = Depends(require("products", "read")),
         db: Session = Depends(get_db)
 ):
-    check_permission(current_user, "products", "read", db)
+    query = page.query(grant)
+    if page.export_format:
+        return export_response(query, page.export_format, "products")
+    return page.build(db.execute(query.limit(page.limit)), response)
 
-    # Если есть право читать все, показываем все продукты
-    if current_user.role.name == "admin":
-        products = db.query(Product).all()
-    else:
-        # Иначе только свои продукты
-        products = db.query(Product).filter(Product.owner_id == current_user.id).all()
 
-    return products
+@router.post("/products:batch", response_model=BatchResult)
+def create_products_batch(
+        batch: ProductBatchCreate,
+        current_user: Principal = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    # Один INSERT ... RETURNING на всю пачку
+    return product_batch.create_products(db, current_user, [item.dict() for item in batch.items])
+
 
+@router.put("/products:batch", response_model=BatchResult)
+def update_products_batch(
+        batch: ProductBatchUpdate,
+        current_user: Principal = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    return product_batch.update_products(db, current_user, [item.dict() for item in batch.items])
 
-@router.post("/products")
+
+@router.delete("/products:batch", response_model=BatchResult)
+def delete_products_batch(
+        batch: ProductBatchDelete,
+        current_user: Principal = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    return product_batch.delete_products(db, current_user, batch.ids)
+
+
+@router.post("/products", response_model=ProductOut)
 def create_product(
         product: ProductSchema,
-        current_user: User = Depends(get_current_user),
+        grant: Grant = Depends(require("products", "create")),
         db: Session = Depends(get_db)
 ):
-    check_permission(current_user, "products", "create", db)
     new_product = Product(
         name=product.name,
         description=product.description,
-        owner_id=current_user.id
+        owner_id=grant.user.id
     )
     db.add(new_product)
     db.commit()
@@ -56,46 +157,22 @@ def create_product(
     return new_product
 
 
-@router.put("/products/{product_id}")
+@router.put("/products/{product_id}", response_model=ProductOut)
 def update_product(
         product_id: int,
         product: ProductSchema,
-        current_user: User = Depends(get_current_user),
+        current_user: Principal = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
-    db_product = db.query(Product).filter(Product.id == product_id).first()
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Product not found")
-
-    # Проверяем права
-    if db_product.owner_id == current_user.id:
-        check_permission(current_user, "products", "update", db)
-    else:
-        check_permission(current_user, "products", "update_all", db)
-
-    db_product.name = product.name
-    db_product.description = product.description
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    # Проверка владельца и запись - один атомарный UPDATE ... RETURNING
+    return product_service.update_product(db, current_user, product_id, product.dict())
 
 
 @router.delete("/products/{product_id}")
 def delete_product(
         product_id: int,
-        current_user: User = Depends(get_current_user),
+        current_user: Principal = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
-    db_product = db.query(Product).filter(Product.id == product_id).first()
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Product not found")
-
-    # Проверяем права
-    if db_product.owner_id == current_user.id:
-        check_permission(current_user, "products", "delete", db)
-    else:
-        check_permission(current_user, "products", "delete_all", db)
-
-    db.delete(db_product)
-    db.commit()
+    product_service.delete_product(db, current_user, product_id)
     return {"detail": "Product deleted"}
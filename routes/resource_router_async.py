@@ -0,0 +1,100 @@
+from fastapi import APIRouter, Depends, Response
+from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.db import get_async_db
+from models.product import Product
+from middlewares.authorization import refresh_permissions_async
+from middlewares.resources import Grant, require
+from services.principal_cache import Principal
+from utils.export import export_response_async
+from services import product_batch, product_service
+from routes.resource_router import (
+    BatchResult, ProductBatchCreate, ProductBatchDelete, ProductBatchUpdate,
+    ProductOut, ProductPage, ProductSchema, get_current_user,
+)
+
+# Асинхронные версии эндпоинтов routes/resource_router.py (DB_ASYNC=1)
+router = APIRouter()
+
+
+@router.get("/products", response_model=List[ProductOut])
+async def get_products(
+        response: Response,
+        page: ProductPage = Depends(),
+        grant: Grant = Depends(require("products", "read")),
+        db: AsyncSession = Depends(get_async_db)
+):
+    query = page.query(grant)
+    if page.export_format:
+        return export_response_async(query, page.export_format, "products")
+    return page.build(await db.execute(query.limit(page.limit)), response)
+
+
+@router.post("/products:batch", response_model=BatchResult)
+async def create_products_batch(
+        batch: ProductBatchCreate,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    await refresh_permissions_async(db)
+    # Логика пачек общая с синхронным роутером, запросы идут через asyncpg
+    return await db.run_sync(product_batch.create_products, current_user, [item.dict() for item in batch.items])
+
+
+@router.put("/products:batch", response_model=BatchResult)
+async def update_products_batch(
+        batch: ProductBatchUpdate,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    await refresh_permissions_async(db)
+    return await db.run_sync(product_batch.update_products, current_user, [item.dict() for item in batch.items])
+
+
+@router.delete("/products:batch", response_model=BatchResult)
+async def delete_products_batch(
+        batch: ProductBatchDelete,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    await refresh_permissions_async(db)
+    return await db.run_sync(product_batch.delete_products, current_user, batch.ids)
+
+
+@router.post("/products", response_model=ProductOut)
+async def create_product(
+        product: ProductSchema,
+        grant: Grant = Depends(require("products", "create")),
+        db: AsyncSession = Depends(get_async_db)
+):
+    new_product = Product(
+        name=product.name,
+        description=product.description,
+        owner_id=grant.user.id
+    )
+    db.add(new_product)
+    await db.commit()
+    return new_product
+
+
+@router.put("/products/{product_id}", response_model=ProductOut)
+async def update_product(
+        product_id: int,
+        product: ProductSchema,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    await refresh_permissions_async(db)
+    # Проверка владельца и запись - один атомарный UPDATE ... RETURNING
+    return await db.run_sync(product_service.update_product, current_user, product_id, product.dict())
+
+
+@router.delete("/products/{product_id}")
+async def delete_product(
+        product_id: int,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    await refresh_permissions_async(db)
+    await db.run_sync(product_service.delete_product, current_user, product_id)
+    return {"detail": "Product deleted"}
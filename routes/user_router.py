@@ -1,16 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from database.db import get_db
-from models.user import User
-from utils.security import hash_password, verify_password
+from models.user import User, email_equals, normalize_email
+from services.password_hasher import password_hasher
 from pydantic import BaseModel, EmailStr
 from typing import Optional
-from middlewares.authorization import check_permission
+from middlewares.resources import Grant, require
+from services.principal_cache import Principal, invalidate_principal
+from services.email_filter import email_filter
+from services.auth_tokens import revoke_access_token, revoke_refresh_token, revoke_user_refresh_tokens
+from utils.export import ExportFormat, export_response
+from utils.pagination import keyset_page
 
 router = APIRouter()
 
 # ---------------- Current User ----------------
-def get_current_user(request: Request) -> User:
+def get_current_user(request: Request) -> Principal:
     user = request.state.user
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -24,9 +31,50 @@ class UpdateUserSchema(BaseModel):
     password: Optional[str]
     current_password: str
 
+class LogoutSchema(BaseModel):
+    refresh_token: Optional[str] = None
+
+# ---------------- Listing ----------------
+USERS_PAGE_DEFAULT_LIMIT = 100
+USERS_PAGE_MAX_LIMIT = 1000
+# В списке отдаются только эти колонки, hashed_password не читается вовсе
+USER_LIST_COLUMNS = (User.id, User.first_name, User.last_name, User.email, User.role_id, User.is_active)
+
+
+class UserPage:
+    """Параметры страницы /users/all: keyset-пагинация по id и фильтры"""
+
+    def __init__(
+        self,
+        after_id: Optional[int] = None,
+        limit: int = Query(USERS_PAGE_DEFAULT_LIMIT, ge=1, le=USERS_PAGE_MAX_LIMIT),
+        role_id: Optional[int] = None,
+        is_active: Optional[bool] = None,
+        email_prefix: Optional[str] = None,
+        export_format: Optional[ExportFormat] = Query(None, alias="format"),
+    ):
+        self.limit = limit
+        self.export_format = export_format
+        query = select(*USER_LIST_COLUMNS)
+        if after_id is not None:
+            query = query.where(User.id > after_id)
+        if role_id is not None:
+            query = query.where(User.role_id == role_id)
+        if is_active is not None:
+            query = query.where(User.is_active == is_active)
+        if email_prefix:
+            # email хранятся в нижнем регистре - префикс приводим так же; % и _ экранируются (autoescape)
+            query = query.where(User.email.startswith(normalize_email(email_prefix), autoescape=True))
+        # Выгрузка (?format=ndjson|csv) идет потоком по всем подходящим строкам, без limit
+        self.export_statement = query.order_by(User.id)
+        self.statement = self.export_statement.limit(limit)
+
+    def build(self, rows, response: Response) -> list:
+        return keyset_page(rows, self.limit, response)
+
 # ---------------- Routes ----------------
 @router.get("/me")
-def read_current_user(current_user: User = Depends(get_current_user)):
+def read_current_user(current_user: Principal = Depends(get_current_user)):
     return {
         "id": current_user.id,
         "first_name": current_user.first_name,
@@ -36,61 +84,77 @@ def read_current_user(current_user: User = Depends(get_current_user)):
     }
 
 @router.get("/all")
-def get_all_users(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    check_permission(current_user, element="users", action="read", db=db)
-    users = db.query(User).all()
-    return [
-        {
-            "id": user.id,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "role_id": user.role_id,
-            "is_active": user.is_active
-        } for user in users
-    ]
+def get_all_users(
+    response: Response,
+    page: UserPage = Depends(),
+    db: Session = Depends(get_db),
+    grant: Grant = Depends(require("users", "read"))
+):
+    # Без read_all пользователь видит в списке только себя
+    if page.export_format:
+        return export_response(grant.scope(page.export_statement), page.export_format, "users")
+    return page.build(db.execute(grant.scope(page.statement)), response)
 
 @router.post("/logout")
-def logout():
+def logout(request: Request, data: Optional[LogoutSchema] = None, db: Session = Depends(get_db)):
+    # Текущий access-токен попадает в список отозванных, refresh-токен больше не обменять
+    if request.state.token:
+        revoke_access_token(db, request.state.token)
+    if data and data.refresh_token:
+        revoke_refresh_token(db, data.refresh_token)
+    db.commit()
     return {"message": "Logged out successfully"}
 
 @router.delete("/me")
 def delete_current_user(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    current_user.is_active = False
+    user = db.get(User, current_user.id)
+    user.is_active = False
+    revoke_user_refresh_tokens(db, user.id)
     db.commit()
+    invalidate_principal(current_user.id)
     return {"message": "User account deactivated"}
 
 @router.patch("/me")
 def update_current_user(
     data: UpdateUserSchema,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    if not verify_password(data.current_password, current_user.hashed_password):
+    # В кэше лежит снимок без пароля - загружаем пользователя в текущую сессию
+    user = db.get(User, current_user.id)
+    if not password_hasher.verify(data.current_password, user.hashed_password):
         raise HTTPException(status_code=403, detail="Incorrect current password")
 
     if data.first_name:
-        current_user.first_name = data.first_name
+        user.first_name = data.first_name
     if data.last_name:
-        current_user.last_name = data.last_name
+        user.last_name = data.last_name
     if data.email:
         # Проверяем, что email не занят другим пользователем
-        existing_user = db.query(User).filter(User.email == data.email, User.id != current_user.id).first()
+        existing_user = db.query(User.id).filter(email_equals(data.email), User.id != current_user.id).first()
         if existing_user:
             raise HTTPException(status_code=400, detail="Email already taken")
-        current_user.email = data.email
+        user.email = normalize_email(data.email)
+        # Новый адрес виден фильтрам других процессов через журнал смен
+        email_filter.record_change(db, user.email)
     if data.password:
-        current_user.hashed_password = hash_password(data.password)
+        user.hashed_password = password_hasher.hash(data.password)
 
-    db.commit()
-    db.refresh(current_user)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Тот же email параллельно занял другой пользователь - сработал уникальный индекс
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Email already taken")
+    db.refresh(user)
+    invalidate_principal(user.id)
 
     return {
-        "id": current_user.id,
-        "first_name": current_user.first_name,
-        "last_name": current_user.last_name,
-        "email": current_user.email
+        "id": user.id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "email": user.email
     }
\ No newline at end of file
@@ -0,0 +1,99 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.db import get_async_db
+from models.user import User, email_equals, normalize_email
+from services.password_hasher import password_hasher
+from middlewares.resources import Grant, require
+from services.principal_cache import Principal, invalidate_principal
+from services.email_filter import email_filter
+from services.auth_tokens import revoke_access_token, revoke_refresh_token, revoke_user_refresh_tokens
+from utils.export import export_response_async
+from routes.user_router import LogoutSchema, UpdateUserSchema, UserPage, get_current_user, read_current_user
+
+# Асинхронные версии эндпоинтов routes/user_router.py (DB_ASYNC=1)
+router = APIRouter()
+
+# Этот эндпоинт не обращается к БД - берем его как есть
+router.add_api_route("/me", read_current_user, methods=["GET"])
+
+
+@router.get("/all")
+async def get_all_users(
+    response: Response,
+    page: UserPage = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+    grant: Grant = Depends(require("users", "read"))
+):
+    if page.export_format:
+        return export_response_async(grant.scope(page.export_statement), page.export_format, "users")
+    return page.build(await db.execute(grant.scope(page.statement)), response)
+
+
+@router.post("/logout")
+async def logout(request: Request, data: Optional[LogoutSchema] = None, db: AsyncSession = Depends(get_async_db)):
+    # Текущий access-токен попадает в список отозванных, refresh-токен больше не обменять
+    if request.state.token:
+        await db.run_sync(revoke_access_token, request.state.token)
+    if data and data.refresh_token:
+        await db.run_sync(revoke_refresh_token, data.refresh_token)
+    await db.commit()
+    return {"message": "Logged out successfully"}
+
+
+@router.delete("/me")
+async def delete_current_user(
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    user = await db.get(User, current_user.id)
+    user.is_active = False
+    await db.run_sync(revoke_user_refresh_tokens, user.id)
+    await db.commit()
+    invalidate_principal(current_user.id)
+    return {"message": "User account deactivated"}
+
+
+@router.patch("/me")
+async def update_current_user(
+    data: UpdateUserSchema,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    user = await db.get(User, current_user.id)
+    if not await password_hasher.verify_async(data.current_password, user.hashed_password):
+        raise HTTPException(status_code=403, detail="Incorrect current password")
+
+    if data.first_name:
+        user.first_name = data.first_name
+    if data.last_name:
+        user.last_name = data.last_name
+    if data.email:
+        # Проверяем, что email не занят другим пользователем
+        existing_user = await db.scalar(
+            select(User.id).where(email_equals(data.email), User.id != current_user.id)
+        )
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Email already taken")
+        user.email = normalize_email(data.email)
+        # Новый адрес виден фильтрам других процессов через журнал смен
+        email_filter.record_change(db, user.email)
+    if data.password:
+        user.hashed_password = await password_hasher.hash_async(data.password)
+
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Тот же email параллельно занял другой пользователь - сработал уникальный индекс
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Email already taken")
+    invalidate_principal(user.id)
+
+    return {
+        "id": user.id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "email": user.email
+    }
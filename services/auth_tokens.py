@@ -0,0 +1,210 @@
+import threading
+import time
+from calendar import timegm
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from database.db import SessionLocal
+from models.refresh_token import RefreshToken
+from models.user import User
+from models.revoked_token import RevokedToken
+from utils.security import create_access_token, create_refresh_token, decode_access_token
+from services.shared_cache import invalidation_bus
+from utils.id_cursor import IdCursor
+
+# Как часто подтягивать отзывы, сделанные другими процессами
+REVOCATION_SYNC_SECONDS = 5
+REVOCATION_BUCKET_SECONDS = 60
+# Как часто удалять из БД истекшие отзывы и refresh-токены
+TOKEN_CLEANUP_SECONDS = 3600
+
+
+class RevocationList:
+    """Отозванные jti в памяти, разложенные по корзинам времени истечения"""
+
+    def __init__(self, bucket_seconds: int = REVOCATION_BUCKET_SECONDS, sync_seconds: float = REVOCATION_SYNC_SECONDS,
+                 cleanup_seconds: float = TOKEN_CLEANUP_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.sync_seconds = sync_seconds
+        self.cleanup_seconds = cleanup_seconds
+        self._expiry: Dict[str, float] = {}
+        self._buckets: Dict[int, Set[str]] = {}
+        # Отзыв с меньшим id может закоммититься позже - курсор перепроверяет пропуски
+        self._cursor = IdCursor()
+        self._synced_at = 0.0
+        self._cleaned_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def add(self, jti: str, expires_at: float):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._expiry[jti] = expires_at
+            self._buckets.setdefault(int(expires_at // self.bucket_seconds), set()).add(jti)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        if not jti:
+            return False
+        expires_at = self._expiry.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    def prune(self):
+        # Корзины целиком в прошлом - токены из них истекли и отзыв больше не нужен
+        current = int(time.time() // self.bucket_seconds)
+        with self._lock:
+            for bucket in [b for b in self._buckets if b < current]:
+                for jti in self._buckets.pop(bucket):
+                    self._expiry.pop(jti, None)
+
+    def request_sync(self):
+        self._synced_at = 0.0
+
+    def sync_due(self) -> bool:
+        return time.monotonic() - self._synced_at > self.sync_seconds
+
+    def sync(self, db: Optional[Session] = None):
+        """Догружает из БД отзывы, появившиеся после последней синхронизации"""
+        # Отмечаем сразу, чтобы параллельные запросы не запускали синхронизацию повторно
+        self._synced_at = time.monotonic()
+        # Курсор не потокобезопасен: синхронизация уже идет - ее результата достаточно
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at)
+                .where(self._cursor.condition(RevokedToken.id), RevokedToken.expires_at > datetime.utcnow())
+                .order_by(RevokedToken.id)
+            ).all()
+            for row in rows:
+                self.add(row.jti, to_timestamp(row.expires_at))
+            self._cursor.advance(row.id for row in rows)
+            if own_session and time.monotonic() - self._cleaned_at > self.cleanup_seconds:
+                self._cleaned_at = time.monotonic()
+                delete_expired_tokens(db)
+        finally:
+            if own_session:
+                db.close()
+            self._sync_lock.release()
+        self.prune()
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+revocation_list = RevocationList()
+
+
+def apply_remote_revocation(key):
+    # Отзыв из другого процесса виден сразу; key=None (переподключение) - догружаемся из БД
+    if key is None:
+        revocation_list.request_sync()
+    else:
+        revocation_list.add(*key)
+
+
+invalidation_bus.on("revocations", apply_remote_revocation)
+
+
+def to_timestamp(value: datetime) -> float:
+    # В БД и в токенах время хранится в UTC без часового пояса
+    return float(timegm(value.utctimetuple()))
+
+
+def delete_expired_tokens(db: Session):
+    # Истекшие токены не пройдут проверку exp - ни отзыв, ни запись для ротации больше не нужны
+    now = datetime.utcnow()
+    db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+    db.execute(delete(RefreshToken).where(RefreshToken.expires_at <= now))
+    db.commit()
+
+
+def load_revocations():
+    """Загрузка отзывов при старте; заодно чистим истекшие записи (дальше - раз в TOKEN_CLEANUP_SECONDS)"""
+    db = SessionLocal()
+    try:
+        delete_expired_tokens(db)
+        revocation_list.sync(db)
+    finally:
+        db.close()
+
+
+def store_refresh_token(db: Session, user_id: int):
+    refresh_token, jti, expires_at = create_refresh_token(user_id)
+    db.add(RefreshToken(jti=jti, user_id=user_id, expires_at=expires_at))
+    return refresh_token, jti
+
+
+def issue_token_pair(db: Session, user_id: int) -> dict:
+    """Новая пара токенов; refresh-токен запоминается в БД для ротации и отзыва"""
+    refresh_token, _ = store_refresh_token(db, user_id)
+    return token_response(user_id, refresh_token)
+
+
+def token_response(user_id: int, refresh_token: str) -> dict:
+    return {
+        "access_token": create_access_token({"user_id": user_id}),
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+    }
+
+
+def rotate_refresh_token(db: Session, token: str) -> dict:
+    payload = decode_access_token(token)
+    if not payload or payload.get("type") != "refresh":
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    stored = db.execute(
+        select(RefreshToken).where(RefreshToken.jti == payload.get("jti")).with_for_update()
+    ).scalar_one_or_none()
+    if stored is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    if stored.revoked_at is not None:
+        # Повторное использование уже обмененного токена - считаем его украденным
+        revoke_user_refresh_tokens(db, stored.user_id)
+        db.commit()
+        raise HTTPException(status_code=401, detail="Refresh token reused")
+
+    user = db.get(User, stored.user_id)
+    if not user or not user.is_active:
+        raise HTTPException(status_code=401, detail="Account deactivated")
+
+    refresh_token, jti = store_refresh_token(db, stored.user_id)
+    stored.revoked_at = datetime.utcnow()
+    stored.replaced_by = jti
+    return token_response(stored.user_id, refresh_token)
+
+
+def revoke_access_token(db: Session, payload: dict):
+    jti, exp = payload.get("jti"), payload.get("exp")
+    if not jti or not exp:
+        return
+    db.add(RevokedToken(jti=jti, expires_at=datetime.utcfromtimestamp(exp)))
+    revocation_list.add(jti, exp)
+    invalidation_bus.publish("revocations", [jti, exp])
+
+
+def revoke_refresh_token(db: Session, token: str):
+    payload = decode_access_token(token)
+    if not payload or payload.get("type") != "refresh":
+        return
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.jti == payload.get("jti"), RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+
+
+def revoke_user_refresh_tokens(db: Session, user_id: int):
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+from database.config import env_int
+from database.db import SessionLocal
+from models.email_change import EmailChange
+from models.user import User, normalize_email
+from utils.id_cursor import IdCursor
+
+logger = logging.getLogger(__name__)
+
+EMAIL_FILTER_CAPACITY = env_int("EMAIL_FILTER_CAPACITY", 1_000_000)
+EMAIL_FILTER_ERROR_RATE = 0.01
+# Догрузка новых пользователей и смен email из других процессов; полная пересборка (в фоне) - чтобы
+# удаленные адреса не копили ложные срабатывания
+EMAIL_FILTER_SYNC_SECONDS = env_int("EMAIL_FILTER_SYNC_SECONDS", 1)
+EMAIL_FILTER_REBUILD_SECONDS = env_int("EMAIL_FILTER_REBUILD_SECONDS", 300)
+EMAIL_FILTER_BATCH_SIZE = 10_000
+# Журнал смен перечитывается с запасом: транзакция могла закоммититься позже своего changed_at
+EMAIL_CHANGES_SLACK_SECONDS = 60
+
+
+class BloomFilter:
+    """Множество без ложноотрицательных ответов; ложноположительных - около error_rate"""
+
+    def __init__(self, capacity: int, error_rate: float = EMAIL_FILTER_ERROR_RATE):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Двойное хеширование: k позиций из двух половин одного дайджеста
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class EmailFilter:
+    """Bloom-фильтр email из users: несуществующий email отсекается без запроса к БД"""
+
+    def __init__(self, capacity: int = EMAIL_FILTER_CAPACITY, sync_seconds: float = EMAIL_FILTER_SYNC_SECONDS,
+                 rebuild_seconds: float = EMAIL_FILTER_REBUILD_SECONDS):
+        self.capacity = capacity
+        self.sync_seconds = sync_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self._bloom: Optional[BloomFilter] = None
+        self._users = IdCursor()
+        self._changes_since = datetime.utcnow()
+        self._synced_at = 0.0
+        self._built_at = 0.0
+        self._rebuilding = False
+        # Журнал смен мог быть подчищен раньше, чем мы его дочитали - до пересборки фильтру не верим
+        self._stale = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    def might_exist(self, email: str) -> bool:
+        # До первой сборки фильтра - всегда идем в БД
+        return self._bloom is None or normalize_email(email) in self._bloom
+
+    def add(self, email: str):
+        if self._bloom is not None:
+            self._bloom.add(normalize_email(email))
+
+    def record_change(self, db: Session, email: str):
+        """Смена email: запись в журнал (в транзакции вызывающего) и сразу в свой фильтр"""
+        db.add(EmailChange(email=normalize_email(email)))
+        self.add(email)
+
+    def rebuild(self, db: Optional[Session] = None):
+        """Полная сборка; запросы тем временем работают со старым фильтром"""
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            started, changes_since = time.monotonic(), datetime.utcnow()
+            count = db.scalar(select(func.count()).select_from(User))
+            # Запас на рост, чтобы доля ложных срабатываний не уползла до следующей пересборки
+            bloom, users = BloomFilter(max(self.capacity, 2 * count)), IdCursor()
+            rows = db.execute(
+                select(User.id, User.email).order_by(User.id)
+                .execution_options(yield_per=EMAIL_FILTER_BATCH_SIZE)
+            )
+            for batch in rows.partitions():
+                for row in batch:
+                    bloom.add(normalize_email(row.email))
+                users.advance(row.id for row in batch)
+            with self._lock:
+                self._bloom, self._users, self._built_at = bloom, users, started
+                self._stale = False
+                self._changes_since = changes_since - timedelta(seconds=EMAIL_CHANGES_SLACK_SECONDS)
+            # Все, что появилось за время сборки
+            self.sync(db)
+            if own_session:
+                # Процесс, не догружавшийся дольше периода пересборки, помечает себя stale (см. refresh)
+                prune_email_changes(db, changes_since - timedelta(seconds=self.rebuild_seconds + EMAIL_CHANGES_SLACK_SECONDS))
+        finally:
+            if own_session:
+                db.close()
+
+    def rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._background_rebuild, name="email-filter-rebuild", daemon=True).start()
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("email filter rebuild failed")
+            # Следующая попытка - через период пересборки, а не на каждом промахе
+            self._built_at = time.monotonic()
+        finally:
+            self._rebuilding = False
+
+    def sync(self, db: Session):
+        """Новые пользователи (по id, с перепроверкой пропусков) и смены email из журнала"""
+        with self._lock:
+            self._synced_at = time.monotonic()
+            rows = db.execute(select(User.id, User.email).where(self._users.condition(User.id))).all()
+            for row in rows:
+                self._bloom.add(normalize_email(row.email))
+            self._users.advance(row.id for row in rows)
+
+            now = datetime.utcnow()
+            for email in db.scalars(select(EmailChange.email).where(EmailChange.changed_at >= self._changes_since)):
+                self._bloom.add(email)
+            self._changes_since = now - timedelta(seconds=EMAIL_CHANGES_SLACK_SECONDS)
+
+    def refresh(self, db: Session):
+        if self._bloom is None:
+            self.rebuild(db)
+            return
+        now = time.monotonic()
+        if now - self._synced_at > self.rebuild_seconds:
+            self._stale = True
+        if self._stale or now - self._built_at > self.rebuild_seconds:
+            # Полный проход по users не должен выполняться внутри запроса
+            self.rebuild_in_background()
+        if not self._stale and now - self._synced_at > self.sync_seconds:
+            self.sync(db)
+
+    def refresh_due(self) -> bool:
+        return self._bloom is not None and time.monotonic() - self._synced_at > self.sync_seconds
+
+    def may_exist(self, email: str, db: Session) -> bool:
+        """Проверка для логина: отрицательный ответ перепроверяется после догрузки, если она назрела"""
+        if self.might_exist(email):
+            return True
+        if self.refresh_due():
+            self.refresh(db)
+            return self.might_exist(email) or self._stale
+        return self._stale
+
+    async def may_exist_async(self, email: str, db) -> bool:
+        if self.might_exist(email):
+            return True
+        if self.refresh_due():
+            await db.run_sync(self.refresh)
+            return self.might_exist(email) or self._stale
+        return self._stale
+
+
+def prune_email_changes(db: Session, before: datetime):
+    # Журнал нужен только до следующей полной пересборки во всех процессах
+    db.execute(delete(EmailChange).where(EmailChange.changed_at < before))
+    db.commit()
+
+
+email_filter = EmailFilter()
@@ -1,52 +1,137 @@
+import os
+from typing import Dict
+
+from sqlalchemy import Connection, func, delete, select, text
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import Session
+from database.db import Base, dialect_insert, engine
 from models.role import Role
-from database.db import SessionLocal
+from models.user import User, email_equals, normalize_email
 from models.access_roles_rules import AccessRolesRules
+from middlewares.authorization import PERMISSION_ACTIONS, invalidate_permissions
+from middlewares.resources import resources
+from utils.security import hash_password
+import models.product
+import models.refresh_token
+import models.revoked_token
+import models.email_change
+
+# Декларативное описание ролей и прав; bootstrap приводит БД к этому состоянию
+DEFAULT_ROLES = {
+    "admin": "Administrator",
+    "user": "Regular User",
+}
+
+DEFAULT_RULES = {
+    # Все права на каждый зарегистрированный ресурс (middlewares/resources.py)
+    "admin": {element: resource.permissions for element, resource in resources.items()},
+    "user": {
+        # Только свой профиль и свои продукты
+        "users": {"read", "update", "delete"},
+        "products": {"read", "create", "update", "delete"},
+    },
+}
+
+ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "admin@example.com")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
+
+# Ключ advisory-блокировки: параллельные деплои выполняют bootstrap по очереди
+BOOTSTRAP_LOCK_ID = 0x61757468
+
+
+def create_schema(conn: Connection):
+    """Недостающие таблицы и индексы; существующие не трогаются"""
+    Base.metadata.create_all(conn)
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    remove_duplicate_rules(conn)
+    check_case_duplicate_emails(conn)
+    # Прежний неуникальный вариант индекса по lower(email)
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_email_lower"))
+    # IF NOT EXISTS вместо checkfirst: рефлексия SQLite не видит индексов по выражениям
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def check_case_duplicate_emails(conn: Connection):
+    # Старые записи без нормализации: уникальный индекс по lower(email) на них не создать
+    duplicates = conn.scalars(
+        select(func.lower(User.email)).group_by(func.lower(User.email)).having(func.count() > 1).limit(10)
+    ).all()
+    if duplicates:
+        raise RuntimeError(f"users with emails differing only in case, merge them first: {', '.join(duplicates)}")
+
+
+def remove_duplicate_rules(conn: Connection):
+    # Старый create_default_rules дублировал правила; оставляем самое раннее
+    keep = select(func.min(AccessRolesRules.id)).group_by(AccessRolesRules.role_id, AccessRolesRules.element)
+    conn.execute(delete(AccessRolesRules).where(AccessRolesRules.id.not_in(keep.scalar_subquery())))
+
+
+def upsert_roles(db: Session) -> Dict[str, int]:
+    insert = dialect_insert(db.get_bind())
+    statement = insert(Role).values([
+        {"name": name, "description": description} for name, description in DEFAULT_ROLES.items()
+    ])
+    db.execute(statement.on_conflict_do_update(
+        index_elements=["name"], set_={"description": statement.excluded.description}
+    ))
+    return {name: role_id for role_id, name in db.execute(
+        select(Role.id, Role.name).where(Role.name.in_(DEFAULT_ROLES))
+    )}
+
+
+def upsert_rules(db: Session, role_ids: Dict[str, int]):
+    rows = [
+        {
+            "role_id": role_ids[role],
+            "element": element,
+            **{f"{action}_permission": action in actions for action in PERMISSION_ACTIONS},
+        }
+        for role, elements in DEFAULT_RULES.items()
+        for element, actions in elements.items()
+    ]
+    insert = dialect_insert(db.get_bind())
+    statement = insert(AccessRolesRules).values(rows)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=["role_id", "element"],
+        set_={f"{action}_permission": statement.excluded[f"{action}_permission"] for action in PERMISSION_ACTIONS},
+    ))
+
+
+def ensure_admin(db: Session, role_id: int) -> bool:
+    # Пароль существующего админа не перезаписываем
+    if db.scalar(select(User.id).where(email_equals(ADMIN_EMAIL))) is not None:
+        return False
+    insert = dialect_insert(db.get_bind())
+    db.execute(insert(User).values(
+        first_name="Admin",
+        last_name="User",
+        email=normalize_email(ADMIN_EMAIL),
+        hashed_password=hash_password(ADMIN_PASSWORD),
+        role_id=role_id,
+        is_active=True,
+    ).on_conflict_do_nothing(index_elements=["email"]))
+    return True
+
+
+def bootstrap() -> bool:
+    """Схема, роли, правила и админ в одной транзакции; повторный запуск ничего не дублирует.
+
+    Возвращает True, если админ был создан.
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": BOOTSTRAP_LOCK_ID})
+        create_schema(conn)
+        db = Session(bind=conn)
+        role_ids = upsert_roles(db)
+        upsert_rules(db, role_ids)
+        admin_created = ensure_admin(db, role_ids["admin"])
+        db.flush()
+    invalidate_permissions()
+    return admin_created
+
 
 def create_default_rules():
-    db: Session = SessionLocal()
-    try:
-        roles = db.query(Role).all()
-        for role in roles:
-            if role.name == "admin":
-                rules = [
-                    AccessRolesRules(
-                        role_id=role.id,
-                        element="users",
-                        read_all_permission=True,
-                        update_all_permission=True,
-                        delete_all_permission=True,
-                        create_permission=True
-                    ),
-                    AccessRolesRules(
-                        role_id=role.id,
-                        element="products",
-                        read_all_permission=True,
-                        update_all_permission=True,
-                        delete_all_permission=True,
-                        create_permission=True
-                    )
-                ]
-            elif role.name == "user":
-                rules = [
-                    AccessRolesRules(
-                        role_id=role.id,
-                        element="users",
-                        read_permission=True,
-                        update_permission=True
-                    ),
-                    AccessRolesRules(
-                        role_id=role.id,
-                        element="products",
-                        read_permission=True,
-                        update_permission=True,
-                        create_permission=True
-                    )
-                ]
-            else:
-                rules = []
-            for rule in rules:
-                db.add(rule)
-        db.commit()
-    finally:
-        db.close()
\ No newline at end of file
+    bootstrap()
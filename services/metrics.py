@@ -0,0 +1,209 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from database.config import env_bool
+
+# METRICS_ENABLED=0 - без middleware и событий курсора, /metrics не регистрируется
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+Labels = Tuple[str, ...]
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Iterable, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Счетчик без меток виден в выдаче сразу, с нулем
+        self._values: Dict[Labels, float] = {} if self.labelnames else {(): 0.0}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам (без кумуляции), сумма, количество]
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, ([*series[0]], series[1], series[2])) for labels, series in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % (bound if bound == "+Inf" else format_value(bound))
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """Значения снимаются при скрейпе: счетчики кэшей, пул соединений"""
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Sequence[str],
+                 collect: Callable[[], Dict[Labels, float]]):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")))
+HTTP_REQUEST_DB_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "DB queries per HTTP request", ("method", "route"), QUERY_COUNT_BUCKETS))
+HTTP_REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in DB queries per HTTP request", ("method", "route")))
+DB_QUERY_SECONDS = registry.register(Histogram(
+    "db_query_duration_seconds", "DB cursor execute latency"))
+PASSWORD_HASH_SECONDS = registry.register(Histogram(
+    "password_hash_duration_seconds", "Password hash/verify latency including pool queue wait", ("operation",)))
+PASSWORD_HASH_REJECTED = registry.register(Counter(
+    "password_hash_rejected_total", "Password operations rejected because the pool was full"))
+PRINCIPAL_FETCH_SECONDS = registry.register(Histogram(
+    "auth_principal_fetch_seconds", "AuthMiddleware user lookups that missed the principal cache"))
+PERMISSION_MATRIX_LOADS = registry.register(Counter(
+    "permission_matrix_loads_total", "Permission matrix reloads from the DB"))
+
+# Счетчики запросов к БД текущего HTTP-запроса: [количество, секунды]
+request_db_stats: ContextVar[Optional[list]] = ContextVar("request_db_stats", default=None)
+
+_caches: Dict[str, object] = {}
+
+
+def register_cache(name: str, cache):
+    """Кэш с атрибутами hits/misses попадает в cache_* метрики"""
+    _caches[name] = cache
+
+
+def cache_counts(attribute: str) -> Dict[Labels, float]:
+    return {(name,): getattr(cache, attribute) for name, cache in _caches.items()}
+
+
+def cache_hit_ratios() -> Dict[Labels, float]:
+    ratios = {}
+    for name, cache in _caches.items():
+        total = cache.hits + cache.misses
+        ratios[(name,)] = cache.hits / total if total else 0.0
+    return ratios
+
+
+def pool_values() -> Dict[Labels, float]:
+    from database.db import pool_stats
+    values = {}
+    for key, value in pool_stats().items():
+        if isinstance(value, dict):
+            for gauge, gauge_value in value.items():
+                values[(f"{key}_{gauge}",)] = gauge_value
+        else:
+            values[(key,)] = value
+    return values
+
+
+registry.register(CallbackMetric("cache_hits_total", "Cache hits", "counter", ("cache",),
+                                 lambda: cache_counts("hits")))
+registry.register(CallbackMetric("cache_misses_total", "Cache misses", "counter", ("cache",),
+                                 lambda: cache_counts("misses")))
+registry.register(CallbackMetric("cache_hit_ratio", "Cache hit ratio since start", "gauge", ("cache",),
+                                 cache_hit_ratios))
+registry.register(CallbackMetric("db_pool", "Connection pool counters and gauges", "gauge", ("stat",),
+                                 pool_values))
+
+
+def attach_query_events(engine):
+    """Время и число запросов через события курсора; для async-движка - его sync_engine"""
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        DB_QUERY_SECONDS.observe(duration)
+        stats = request_db_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += duration
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
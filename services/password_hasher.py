@@ -0,0 +1,98 @@
+import asyncio
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from database.config import env_int
+from services.metrics import PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS
+from utils.security import hash_password, verify_password
+
+# bcrypt отпускает GIL, поэтому по умолчанию достаточно пула потоков
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = env_int("PASSWORD_HASH_WORKERS", os.cpu_count() or 2)
+# Сколько операций может ждать в очереди сверх работающих воркеров
+PASSWORD_HASH_QUEUE_DEPTH = env_int("PASSWORD_HASH_QUEUE_DEPTH", 2 * PASSWORD_HASH_WORKERS)
+PASSWORD_HASH_RETRY_AFTER = 1
+
+
+class PasswordHasherBusy(Exception):
+    """Пул хеширования заполнен - запрос нужно отклонить, а не ставить в очередь"""
+
+
+class PasswordHasher:
+    """Ограниченный пул для bcrypt: не дает логинам занять все потоки приложения"""
+
+    def __init__(self, workers: int, queue_depth: int, executor: str = "thread"):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.executor_type = executor
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self._dummy_hash = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    executor_class = ProcessPoolExecutor if self.executor_type == "process" else ThreadPoolExecutor
+                    self._executor = executor_class(max_workers=self.workers)
+        return self._executor
+
+    def submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHasherBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        started = time.perf_counter()
+        future.add_done_callback(lambda _: self._done(fn.__name__, started))
+        return future
+
+    def _done(self, operation: str, started: float):
+        self._slots.release()
+        PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started, operation)
+
+    def hash(self, password: str) -> str:
+        return self.submit(hash_password, password).result()
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return self.submit(verify_password, plain_password, hashed_password).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self.submit(hash_password, password))
+
+    async def verify_async(self, plain_password: str, hashed_password: str) -> bool:
+        return await asyncio.wrap_future(self.submit(verify_password, plain_password, hashed_password))
+
+    @property
+    def dummy_hash(self) -> str:
+        # Хеш по текущей политике: для несуществующего email проверка стоит столько же, сколько настоящая
+        if self._dummy_hash is None:
+            self._dummy_hash = hash_password(secrets.token_urlsafe(16))
+        return self._dummy_hash
+
+    def dummy_verify(self, password: str) -> bool:
+        self.verify(password, self.dummy_hash)
+        return False
+
+    async def dummy_verify_async(self, password: str) -> bool:
+        await self.verify_async(password, self.dummy_hash)
+        return False
+
+    def shutdown(self, wait: bool = False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=PASSWORD_HASH_WORKERS,
+    queue_depth=PASSWORD_HASH_QUEUE_DEPTH,
+    executor=PASSWORD_HASH_EXECUTOR,
+)
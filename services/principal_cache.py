@@ -0,0 +1,103 @@
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, joinedload
+from database.db import SessionLocal, get_async_sessionmaker
+from models.user import User
+from services.metrics import register_cache
+from services.shared_cache import TieredCache, cache_backend, invalidation_bus
+
+PRINCIPAL_CACHE_TTL_SECONDS = 60
+PRINCIPAL_CACHE_MAX_SIZE = 10_000
+
+
+@dataclass(frozen=True)
+class RoleRef:
+    id: Optional[int]
+    name: Optional[str]
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Снимок аутентифицированного пользователя, не привязанный к сессии БД"""
+    id: int
+    first_name: str
+    last_name: str
+    email: str
+    role_id: Optional[int]
+    role: RoleRef
+    is_active: bool
+    loaded_at: float
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            email=user.email,
+            role_id=user.role_id,
+            role=RoleRef(
+                id=user.role.id if user.role else None,
+                name=user.role.name if user.role else None,
+            ),
+            is_active=bool(user.is_active),
+            loaded_at=time.time(),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Principal":
+        # Обратно из JSON общего кэша (asdict)
+        return cls(**{**data, "role": RoleRef(**data["role"])})
+
+
+principal_cache = TieredCache("principal", PRINCIPAL_CACHE_MAX_SIZE, PRINCIPAL_CACHE_TTL_SECONDS,
+                              backend=cache_backend, bus=invalidation_bus,
+                              encode=asdict, decode=Principal.from_dict)
+register_cache("principal", principal_cache)
+
+
+def get_cached_principal(user_id: int, issued_at: Optional[float] = None, remote: bool = True) -> Optional[Principal]:
+    principal = principal_cache.get(user_id, remote=remote)
+    # Токен выпущен позже снимка (например, после повторного входа) - считаем промахом
+    if principal is not None and (issued_at is None or issued_at <= principal.loaded_at):
+        return principal
+    return None
+
+
+def fetch_principal(user_id: int) -> Optional[Principal]:
+    # Деактивация во время чтения не должна вернуть в кэш старый снимок
+    since = principal_cache.begin_read(user_id)
+    db: Session = SessionLocal()
+    try:
+        # Используем joinedload для загрузки роли вместе с пользователем
+        user = db.query(User).options(joinedload(User.role)).filter(User.id == user_id).first()
+        if not user:
+            return None
+        principal = Principal.from_user(user)
+    finally:
+        db.close()
+
+    principal_cache.set(user_id, principal, since=since)
+    return principal
+
+
+async def fetch_principal_async(user_id: int) -> Optional[Principal]:
+    since = principal_cache.begin_read(user_id)
+    async with get_async_sessionmaker()() as db:
+        result = await db.execute(
+            select(User).options(joinedload(User.role)).where(User.id == user_id)
+        )
+        user = result.scalars().first()
+        if not user:
+            return None
+        principal = Principal.from_user(user)
+
+    principal_cache.set(user_id, principal, since=since)
+    return principal
+
+
+def invalidate_principal(user_id: int):
+    principal_cache.delete(user_id)
@@ -0,0 +1,104 @@
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.orm import Session
+from middlewares.authorization import check_permission
+from middlewares.resources import PRODUCTS
+from models.product import Product
+
+
+def item_result(index: int, product_id: Optional[int], status: int, detail: str = "ok") -> dict:
+    return {"index": index, "id": product_id, "status": status, "detail": detail}
+
+
+def batch_summary(results: List[dict]) -> dict:
+    succeeded = sum(1 for result in results if result["status"] == 200)
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+
+def create_products(db: Session, current_user, items: List[dict]) -> dict:
+    # Все новые продукты принадлежат текущему пользователю - одна проверка на всю пачку
+    check_permission(current_user, "products", "create", db)
+    rows = [
+        {"name": item["name"], "description": item["description"], "owner_id": current_user.id}
+        for item in items
+    ]
+    ids = db.scalars(
+        insert(Product).returning(Product.id, sort_by_parameter_order=True),
+        rows,
+    ).all()
+    db.commit()
+    return batch_summary([item_result(index, product_id, 200) for index, product_id in enumerate(ids)])
+
+
+def load_owners(db: Session, ids: List[int], lock: bool = False) -> Dict[int, Optional[int]]:
+    statement = select(Product.id, Product.owner_id).where(Product.id.in_(ids))
+    if lock:
+        # До commit строки не удалят и не передадут другому владельцу; порядок по id - без взаимных блокировок
+        statement = statement.order_by(Product.id).with_for_update()
+    return {row.id: row.owner_id for row in db.execute(statement)}
+
+
+def authorize_items(db: Session, current_user, ids: List[int], action: str):
+    """Разбивает id пачки на разрешенные и результаты-ошибки (404/403/дубликаты); строки пачки блокируются"""
+    owners = load_owners(db, ids, lock=True)
+    # Права проверяются один раз на всю пачку, дальше - сравнение владельца
+    grant = PRODUCTS.grant(current_user, action, db)
+
+    accepted, errors, seen = [], {}, set()
+    for index, product_id in enumerate(ids):
+        if product_id in seen:
+            errors[index] = item_result(index, product_id, 400, "Duplicate id in batch")
+        elif product_id not in owners:
+            errors[index] = item_result(index, product_id, 404, "Product not found")
+        elif grant is None or not grant.allows(owners[product_id]):
+            errors[index] = item_result(index, product_id, 403, "Access denied")
+        else:
+            accepted.append(index)
+        seen.add(product_id)
+    return accepted, errors, grant
+
+
+def mark_missing(errors: Dict[int, dict], ids: List[int], accepted: List[int], written: set):
+    # Успех - только для реально записанных строк (без блокировки строк, как в SQLite, их могли изменить)
+    for index in accepted:
+        if ids[index] not in written:
+            errors[index] = item_result(index, ids[index], 404, "Product not found")
+
+
+def update_products(db: Session, current_user, items: List[dict]) -> dict:
+    ids = [item["id"] for item in items]
+    accepted, errors, grant = authorize_items(db, current_user, ids, "update")
+    if accepted:
+        # Один UPDATE на всю пачку: значения по id через CASE, условие владельца - в самом UPDATE
+        values = {index: items[index] for index in accepted}
+        updated = set(db.scalars(
+            update(Product)
+            .where(Product.id.in_([ids[index] for index in accepted]), grant.where())
+            .values(
+                name=case({item["id"]: item["name"] for item in values.values()}, value=Product.id),
+                description=case({item["id"]: item["description"] for item in values.values()}, value=Product.id),
+            )
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        ))
+        db.commit()
+        mark_missing(errors, ids, accepted, updated)
+
+    results = [errors.get(index) or item_result(index, product_id, 200) for index, product_id in enumerate(ids)]
+    return batch_summary(results)
+
+
+def delete_products(db: Session, current_user, ids: List[int]) -> dict:
+    accepted, errors, grant = authorize_items(db, current_user, ids, "delete")
+    if accepted:
+        deleted = set(db.scalars(
+            delete(Product)
+            .where(Product.id.in_([ids[index] for index in accepted]), grant.where())
+            .returning(Product.id)
+        ))
+        db.commit()
+        mark_missing(errors, ids, accepted, deleted)
+
+    results = [errors.get(index) or item_result(index, product_id, 200) for index, product_id in enumerate(ids)]
+    return batch_summary(results)
@@ -0,0 +1,56 @@
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, exists, select, update
+from sqlalchemy.orm import Session
+from middlewares.resources import PRODUCTS
+from models.product import Product
+
+PRODUCT_RETURNING = (Product.id, Product.name, Product.description, Product.owner_id)
+
+
+def ownership_filter(db: Session, current_user, action: str):
+    """Условие WHERE по правам из кэша: все продукты, только свои или никакие (None)"""
+    grant = PRODUCTS.grant(current_user, action, db)
+    return grant.where() if grant is not None else None
+
+
+def raise_write_error(db: Session, product_id: int):
+    # Запись не затронула строк: отличаем "нет такого продукта" от "чужой продукт"
+    if db.scalar(select(exists().where(Product.id == product_id))):
+        raise HTTPException(status_code=403, detail="Access denied")
+    raise HTTPException(status_code=404, detail="Product not found")
+
+
+def update_product(db: Session, current_user, product_id: int, values: dict):
+    """UPDATE ... WHERE id AND (owner_id = :uid OR can_update_all) RETURNING - один запрос"""
+    allowed = ownership_filter(db, current_user, "update")
+    row = None
+    if allowed is not None:
+        row = db.execute(
+            update(Product)
+            .where(Product.id == product_id, allowed)
+            .values(**values)
+            .returning(*PRODUCT_RETURNING)
+            .execution_options(synchronize_session=False)
+        ).first()
+    if row is None:
+        raise_write_error(db, product_id)
+    db.commit()
+    return row
+
+
+def delete_product(db: Session, current_user, product_id: int) -> Optional[int]:
+    allowed = ownership_filter(db, current_user, "delete")
+    deleted = None
+    if allowed is not None:
+        deleted = db.scalar(
+            delete(Product)
+            .where(Product.id == product_id, allowed)
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        )
+    if deleted is None:
+        raise_write_error(db, product_id)
+    db.commit()
+    return deleted
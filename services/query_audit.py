@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from database.config import env_bool, env_int
+
+# QUERY_AUDIT=1 (staging) - каждый HTTP-запрос проверяется на N+1, медленные запросы и бюджет
+QUERY_AUDIT = env_bool("QUERY_AUDIT", False)
+QUERY_AUDIT_SLOW_MS = env_int("QUERY_AUDIT_SLOW_MS", 100)
+# Одинаковый SQL (параметры не учитываются) столько раз за запрос - признак N+1
+QUERY_AUDIT_REPEAT_THRESHOLD = env_int("QUERY_AUDIT_REPEAT_THRESHOLD", 3)
+
+# Максимум запросов к БД на эндпоинт, с запасом в один запрос на перезагрузку кэшей
+# (пользователь в AuthMiddleware, матрица прав, список отзывов)
+QUERY_BUDGETS: Dict[Tuple[str, str], int] = {
+    ("POST", "/auth/auth/register"): 5,
+    ("POST", "/auth/auth/login"): 3,
+    ("POST", "/auth/auth/refresh"): 5,
+    ("GET", "/users/me"): 3,
+    ("GET", "/users/all"): 3,
+    ("POST", "/users/logout"): 3,
+    ("PATCH", "/users/me"): 6,
+    ("DELETE", "/users/me"): 4,
+    ("GET", "/resource/products"): 3,
+    ("POST", "/resource/products"): 3,
+    ("PUT", "/resource/products/{product_id}"): 3,
+    ("DELETE", "/resource/products/{product_id}"): 3,
+    ("POST", "/resource/products:batch"): 3,
+    ("PUT", "/resource/products:batch"): 4,
+    ("DELETE", "/resource/products:batch"): 4,
+}
+
+logger = logging.getLogger("query_audit")
+
+
+@dataclass
+class QueryAudit:
+    """SQL-запросы одного HTTP-запроса (или теста) с длительностями"""
+    statements: List[Tuple[str, float]] = field(default_factory=list)
+    slow_ms: float = QUERY_AUDIT_SLOW_MS
+    repeat_threshold: int = QUERY_AUDIT_REPEAT_THRESHOLD
+
+    def record(self, statement: str, duration: float):
+        self.statements.append((statement, duration))
+
+    def reset(self):
+        self.statements.clear()
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def repeated(self) -> Dict[str, int]:
+        counts = Counter(statement for statement, _ in self.statements)
+        return {statement: n for statement, n in counts.items() if n >= self.repeat_threshold}
+
+    def slow(self) -> List[Tuple[str, float]]:
+        return [(statement, duration) for statement, duration in self.statements if duration * 1000 >= self.slow_ms]
+
+    def problems(self, budget: Optional[int] = None) -> List[str]:
+        problems = [f"N+1: {n}x {statement[:200]}" for statement, n in self.repeated().items()]
+        problems += [f"slow query {duration * 1000:.1f}ms: {statement[:200]}" for statement, duration in self.slow()]
+        if budget is not None and self.count > budget:
+            problems.append(f"{self.count} queries, budget {budget}")
+        return problems
+
+
+# Аудит текущего HTTP-запроса (QueryAuditMiddleware)
+current_audit: ContextVar[Optional[QueryAudit]] = ContextVar("current_audit", default=None)
+# Глобальные записи для тестов: TestClient выполняет приложение в другом потоке, contextvar туда не доходит
+_recorders: List[QueryAudit] = []
+_lock = threading.Lock()
+_attached = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._audit_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_audit_started", None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    audit = current_audit.get()
+    if audit is not None:
+        audit.record(statement, duration)
+    for recorder in _recorders:
+        recorder.record(statement, duration)
+
+
+def attach_audit_events():
+    """Слушатели на класс Engine: охватывают и sync, и async (sync_engine) движки"""
+    global _attached
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    with _lock:
+        if not _attached:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            _attached = True
+
+
+def start_recording(**options) -> QueryAudit:
+    attach_audit_events()
+    audit = QueryAudit(**options)
+    with _lock:
+        _recorders.append(audit)
+    return audit
+
+
+def stop_recording(audit: QueryAudit):
+    with _lock:
+        if audit in _recorders:
+            _recorders.remove(audit)
+
+
+def report(method: str, route: str, audit: QueryAudit) -> List[str]:
+    problems = audit.problems(QUERY_BUDGETS.get((method, route)))
+    for problem in problems:
+        logger.warning("%s %s: %s", method, route, problem)
+    return problems
@@ -0,0 +1,208 @@
+import math
+import os
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from database.config import env_bool, env_int
+from services.metrics import Counter, registry
+
+# Лимиты логина: попыток за окно (сек) с одного IP и на один email; 0 - без ограничения
+LOGIN_IP_LIMIT = env_int("LOGIN_IP_LIMIT", 30)
+LOGIN_IP_WINDOW = env_int("LOGIN_IP_WINDOW", 60)
+LOGIN_EMAIL_LIMIT = env_int("LOGIN_EMAIL_LIMIT", 10)
+LOGIN_EMAIL_WINDOW = env_int("LOGIN_EMAIL_WINDOW", 60)
+# Общий backend для нескольких процессов/подов (redis://...); по умолчанию счетчики в памяти процесса
+RATE_LIMIT_BACKEND_URL = os.getenv("RATE_LIMIT_BACKEND_URL", "")
+# За прокси клиентский IP берется из X-Forwarded-For: адрес, дописанный самым дальним из
+# RATE_LIMIT_TRUSTED_HOPS доверенных прокси (левее - что прислал клиент, подделывается)
+RATE_LIMIT_TRUST_FORWARDED = env_bool("RATE_LIMIT_TRUST_FORWARDED", False)
+RATE_LIMIT_TRUSTED_HOPS = env_int("RATE_LIMIT_TRUSTED_HOPS", 1)
+RATE_LIMIT_BACKEND_TIMEOUT_MS = env_int("RATE_LIMIT_BACKEND_TIMEOUT_MS", 250)
+RATE_LIMIT_SHARDS = 16
+# Как часто шард чистит истекшие окна (в операциях)
+RATE_LIMIT_PRUNE_EVERY = 1024
+
+RATE_LIMITED = registry.register(Counter(
+    "rate_limited_total", "Requests rejected by a rate limiter", ("limiter",)))
+
+
+class MemoryBackend:
+    """Счетчики окон в памяти процесса; шарды с отдельными блокировками снимают конкуренцию потоков"""
+
+    blocking = False
+
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._shards: List[Tuple[threading.Lock, Dict[str, list]]] = [
+            (threading.Lock(), {}) for _ in range(shards)
+        ]
+        self._operations = [0] * shards
+
+    def _shard(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % len(self._shards)
+
+    def get(self, key: str) -> int:
+        lock, counters = self._shards[self._shard(key)]
+        with lock:
+            entry = counters.get(key)
+            return entry[0] if entry and entry[1] > self.clock() else 0
+
+    def incr(self, key: str, ttl: float) -> int:
+        index = self._shard(key)
+        lock, counters = self._shards[index]
+        now = self.clock()
+        with lock:
+            entry = counters.get(key)
+            if entry is None or entry[1] <= now:
+                entry = counters[key] = [0, now + ttl]
+            entry[0] += 1
+            self._operations[index] += 1
+            if self._operations[index] % RATE_LIMIT_PRUNE_EVERY == 0:
+                for expired in [k for k, (_, expires_at) in counters.items() if expires_at <= now]:
+                    del counters[expired]
+            return entry[0]
+
+    def hit(self, current_key: str, previous_key: str, ttl: float) -> Tuple[int, int]:
+        # Инкремент под блокировкой шарда: каждая попытка получает свой номер; прошлое окно уже не растет
+        return self.incr(current_key, ttl), self.get(previous_key)
+
+    def clear(self):
+        for lock, counters in self._shards:
+            with lock:
+                counters.clear()
+
+
+# INCR текущего окна и чтение прошлого - одним скриптом, атомарно
+REDIS_HIT_SCRIPT = """
+local current = redis.call('INCR', KEYS[1])
+if current == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+return {current, tonumber(redis.call('GET', KEYS[2]) or '0')}
+"""
+
+
+class RedisBackend:
+    """Общие счетчики в Redis (нужен пакет redis); тот же интерфейс, что у MemoryBackend"""
+
+    blocking = True
+
+    def __init__(self, url: str, timeout_ms: int = RATE_LIMIT_BACKEND_TIMEOUT_MS):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND_URL requires the redis package") from None
+        timeout = timeout_ms / 1000
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._hit = self.client.register_script(REDIS_HIT_SCRIPT)
+
+    def get(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+    def incr(self, key: str, ttl: float) -> int:
+        pipeline = self.client.pipeline()
+        pipeline.incr(key)
+        pipeline.expire(key, math.ceil(ttl))
+        return pipeline.execute()[0]
+
+    def hit(self, current_key: str, previous_key: str, ttl: float) -> Tuple[int, int]:
+        current, previous = self._hit(keys=[current_key, previous_key], args=[max(int(ttl * 1000), 1)])
+        return int(current), int(previous)
+
+
+def build_backend(url: str = RATE_LIMIT_BACKEND_URL):
+    return RedisBackend(url) if url else MemoryBackend()
+
+
+class SlidingWindowLimiter:
+    """Скользящее окно по двум фиксированным: предыдущее окно учитывается с весом оставшейся доли"""
+
+    def __init__(self, name: str, limit: int, window_seconds: int, backend,
+                 clock: Callable[[], float] = time.time):
+        self.name = name
+        self.limit = limit
+        self.window = window_seconds
+        self.backend = backend
+        self.clock = clock
+
+    def _keys(self, key: str, now: float) -> Tuple[str, str, float]:
+        index = int(now // self.window)
+        elapsed = (now - index * self.window) / self.window
+        # {...} - hash tag: оба окна в одном слоте Redis Cluster, скрипт видит оба ключа
+        base = f"rl:{{{self.name}:{key}}}"
+        return f"{base}:{index}", f"{base}:{index - 1}", elapsed
+
+    def _retry(self, current: int, previous: int, elapsed: float) -> float:
+        # current - с учетом проверяемой попытки
+        if previous * (1 - elapsed) + current <= self.limit:
+            return 0.0
+        if current > self.limit or not previous:
+            # Текущее окно уже заполнено - ждем его конца
+            return (1 - elapsed) * self.window
+        # Ждем, пока вес предыдущего окна упадет настолько, чтобы появилось место (0 - уже на границе)
+        return max((1 - (self.limit - current) / previous - elapsed) * self.window, 0.001)
+
+    def retry_after(self, key: str) -> float:
+        """Без учета попытки: 0 - следующая попытка пройдет, иначе через сколько секунд окно освободится"""
+        if self.limit <= 0:
+            return 0.0
+        current_key, previous_key, elapsed = self._keys(key, self.clock())
+        return self._retry(self.backend.get(current_key) + 1, self.backend.get(previous_key), elapsed)
+
+    def hit(self, key: str) -> float:
+        """Учет попытки и решение по счетчику после атомарного инкремента: одновременные попытки не могут
+        все разом пройти проверку. Отклоненные попытки тоже считаются. Возвращает retry_after как retry_after()"""
+        if self.limit <= 0:
+            return 0.0
+        current_key, previous_key, elapsed = self._keys(key, self.clock())
+        # Ключ нужен и следующему окну - как предыдущий
+        current, previous = self.backend.hit(current_key, previous_key, 2 * self.window)
+        retry = self._retry(current, previous, elapsed)
+        if retry:
+            RATE_LIMITED.inc(self.name)
+        return retry
+
+
+rate_limit_backend = build_backend()
+login_ip_limiter = SlidingWindowLimiter("login_ip", LOGIN_IP_LIMIT, LOGIN_IP_WINDOW, rate_limit_backend)
+login_email_limiter = SlidingWindowLimiter("login_email", LOGIN_EMAIL_LIMIT, LOGIN_EMAIL_WINDOW, rate_limit_backend)
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED and RATE_LIMIT_TRUSTED_HOPS > 0:
+        parts = [part.strip() for part in request.headers.get("x-forwarded-for", "").split(",")]
+        # Записей меньше, чем доверенных прокси, - заголовок не от них, берем адрес соединения
+        if len(parts) >= RATE_LIMIT_TRUSTED_HOPS and parts[-RATE_LIMIT_TRUSTED_HOPS]:
+            return parts[-RATE_LIMIT_TRUSTED_HOPS]
+    return request.client.host if request.client else "unknown"
+
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many login attempts, try again later",
+        headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+    )
+
+
+def enforce_login_limits(request: Request, email: Optional[str]):
+    """Вызывается до запроса к БД и bcrypt: лишние попытки не тратят CPU"""
+    retry = login_ip_limiter.hit(client_ip(request))
+    if retry:
+        raise too_many_requests(retry)
+    if email:
+        retry = login_email_limiter.hit(email.strip().lower())
+        if retry:
+            raise too_many_requests(retry)
+
+
+async def enforce_login_limits_async(request: Request, email: Optional[str]):
+    # Общий backend - сетевые запросы, из event loop уводим
+    if rate_limit_backend.blocking:
+        await run_in_threadpool(enforce_login_limits, request, email)
+    else:
+        enforce_login_limits(request, email)
@@ -0,0 +1,372 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from database.config import env_int
+from utils.cache import TTLCache
+from services.metrics import Counter, Histogram, registry
+
+logger = logging.getLogger(__name__)
+
+# Общий L2 и рассылка сбросов между воркерами: redis://... (нужен пакет redis) или memory:// (в пределах процесса);
+# без него кэши остаются локальными
+CACHE_BACKEND_URL = os.getenv("CACHE_BACKEND_URL", "")
+# Таймаут сетевых операций с backend-ом (мс): недоступный Redis не должен подвешивать запросы
+CACHE_BACKEND_TIMEOUT_MS = env_int("CACHE_BACKEND_TIMEOUT_MS", 250)
+# Очередь фоновых записей (SET/DELETE/PUBLISH); при переполнении запись отбрасывается
+CACHE_WRITE_QUEUE_DEPTH = env_int("CACHE_WRITE_QUEUE_DEPTH", 10_000)
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+# Пауза перед переподключением подписки
+CACHE_RESUBSCRIBE_SECONDS = 1.0
+STALENESS_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0)
+
+CACHE_LOOKUPS = registry.register(Counter(
+    "cache_tier_lookups_total", "Tiered cache lookups by the tier that answered (l1, l2 or miss)", ("cache", "tier")))
+CACHE_ENTRY_AGE = registry.register(Histogram(
+    "cache_entry_age_seconds", "Age of cached values when served", ("cache",), buckets=STALENESS_BUCKETS))
+CACHE_INVALIDATIONS = registry.register(Counter(
+    "cache_invalidations_total", "Cache invalidations sent to and received from other processes",
+    ("cache", "direction")))
+CACHE_INVALIDATION_LAG = registry.register(Histogram(
+    "cache_invalidation_lag_seconds", "Delay between publishing an invalidation and applying it", ("cache",)))
+CACHE_BACKEND_ERRORS = registry.register(Counter(
+    "cache_backend_errors_total", "Failed shared cache operations (treated as a miss)", ("operation",)))
+CACHE_RESUBSCRIBES = registry.register(Counter(
+    "cache_invalidation_resubscribes_total", "Invalidation subscriptions (re)established; local caches are flushed"))
+
+
+class MemoryCacheBackend:
+    """L2 и pub/sub в памяти процесса: для тестов и одного воркера (экземпляр можно разделить между кэшами)"""
+
+    # Операции не ходят в сеть - выполняются сразу, без фонового потока
+    blocking = False
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+        self._subscribers: Dict[str, List[Callable[[bytes], None]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= self.clock():
+                self._data.pop(key, None)
+                return None
+            return item[1]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._data[key] = (self.clock() + ttl, value)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def publish(self, channel: str, message: bytes):
+        for callback in list(self._subscribers.get(channel, ())):
+            callback(message)
+
+    def subscribe(self, channel: str, callback: Callable[[bytes], None], on_connect: Callable[[], None]):
+        self._subscribers.setdefault(channel, []).append(callback)
+        on_connect()
+
+
+class RedisCacheBackend:
+    """L2 в Redis, сбросы через PUBLISH/SUBSCRIBE; подписку читает фоновый поток и переподключает ее при ошибках"""
+
+    blocking = True
+
+    def __init__(self, url: str, timeout_ms: int = CACHE_BACKEND_TIMEOUT_MS):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND_URL requires the redis package") from None
+        timeout = timeout_ms / 1000
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._subscriptions: Dict[str, Tuple[Callable[[bytes], None], Callable[[], None]]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(key, value, px=max(int(ttl * 1000), 1))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def publish(self, channel: str, message: bytes):
+        self.client.publish(channel, message)
+
+    def subscribe(self, channel: str, callback: Callable[[bytes], None], on_connect: Callable[[], None]):
+        with self._lock:
+            self._subscriptions[channel] = (callback, on_connect)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name="cache-invalidation", daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                subscriptions = dict(self._subscriptions)
+                pubsub.subscribe(*subscriptions)
+                # Пока подписки не было, сбросы могли пройти мимо - локальные копии больше не доверенные
+                CACHE_RESUBSCRIBES.inc()
+                for _, on_connect in subscriptions.values():
+                    on_connect()
+                while set(self._subscriptions) == set(subscriptions):
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message["type"] == "message":
+                        channel = message["channel"].decode()
+                        self._dispatch(subscriptions[channel][0], message["data"])
+            except Exception:
+                CACHE_BACKEND_ERRORS.inc("subscribe")
+                logger.exception("cache invalidation subscription failed, resubscribing")
+                time.sleep(CACHE_RESUBSCRIBE_SECONDS)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _dispatch(callback: Callable[[bytes], None], data: bytes):
+        # Ошибка обработчика не должна останавливать подписку
+        try:
+            callback(data)
+        except Exception:
+            CACHE_BACKEND_ERRORS.inc("dispatch")
+            logger.exception("cache invalidation handler failed")
+
+
+def build_cache_backend(url: str = CACHE_BACKEND_URL):
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryCacheBackend()
+    return RedisCacheBackend(url)
+
+
+class BackgroundWriter:
+    """Записи в сетевой backend идут из одного фонового потока: запросы и event loop не ждут сети,
+    а порядок операций процесса (SET, затем DELETE и PUBLISH) сохраняется"""
+
+    def __init__(self, max_pending: int = CACHE_WRITE_QUEUE_DEPTH):
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def submit(self, operation: str, fn: Callable, *args):
+        if not self._slots.acquire(blocking=False):
+            CACHE_BACKEND_ERRORS.inc(operation)
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-writer")
+        self._executor.submit(self._run, operation, fn, args)
+
+    def _run(self, operation: str, fn: Callable, args: tuple):
+        try:
+            fn(*args)
+        except Exception:
+            CACHE_BACKEND_ERRORS.inc(operation)
+        finally:
+            self._slots.release()
+
+    def flush(self, timeout: Optional[float] = None):
+        """Дождаться уже поставленных записей"""
+        if self._executor is not None:
+            self._executor.submit(lambda: None).result(timeout)
+
+
+background_writer = BackgroundWriter()
+
+
+def backend_call(backend, operation: str, fn: Callable, *args):
+    # Операции без ответа: сетевые - в фоне, in-memory - сразу
+    if backend.blocking:
+        background_writer.submit(operation, fn, *args)
+        return
+    try:
+        fn(*args)
+    except Exception:
+        CACHE_BACKEND_ERRORS.inc(operation)
+
+
+class InvalidationBus:
+    """Рассылка сбросов кэшей другим процессам; без общего backend-а сбросы остаются локальными.
+
+    При (пере)подключении подписки обработчики вызываются с key=None: сброс целиком.
+    """
+
+    def __init__(self, backend=None, channel: str = CACHE_INVALIDATION_CHANNEL):
+        self.backend = backend
+        self.channel = channel
+        # Свои сообщения возвращаются подписчику - их пропускаем
+        self.origin = uuid.uuid4().hex
+        self._handlers: Dict[str, List[Callable[[Any], None]]] = {}
+        self._subscribed = False
+
+    def on(self, name: str, handler: Callable[[Any], None]):
+        """handler(key) вызывается при сбросе из другого процесса; key=None - сброс целиком"""
+        self._handlers.setdefault(name, []).append(handler)
+        if self.backend is not None and not self._subscribed:
+            self._subscribed = True
+            try:
+                self.backend.subscribe(self.channel, self.receive, self.reset_all)
+            except Exception:
+                CACHE_BACKEND_ERRORS.inc("subscribe")
+                logger.exception("cache invalidation subscription failed")
+
+    def publish(self, name: str, key: Any = None):
+        if self.backend is None:
+            return
+        # Ключ должен пережить JSON: id, строки, списки
+        message = json.dumps({"cache": name, "key": key, "origin": self.origin, "sent_at": time.time()})
+        backend_call(self.backend, "publish", self.backend.publish, self.channel, message.encode())
+        CACHE_INVALIDATIONS.inc(name, "sent")
+
+    def receive(self, message: bytes):
+        data = json.loads(message)
+        if data["origin"] == self.origin:
+            return
+        name = data["cache"]
+        for handler in self._handlers.get(name, ()):
+            handler(data["key"])
+        CACHE_INVALIDATIONS.inc(name, "received")
+        CACHE_INVALIDATION_LAG.observe(max(time.time() - data["sent_at"], 0.0), name)
+
+    def reset_all(self):
+        for handlers in list(self._handlers.values()):
+            for handler in handlers:
+                handler(None)
+
+
+class TieredCache:
+    """L1 в памяти процесса + необязательный общий L2; удаление ключа сбрасывает L1 остальных процессов.
+
+    В L2 значения лежат в JSON: encode приводит значение к JSON-совместимому виду, decode - обратно.
+    Значение, прочитанное из источника до удаления ключа, не должно вернуться в кэш после него:
+    mark = begin_read(key) до чтения, set(key, value, since=mark) после. Локально удаление
+    запоминается номером, в L2 - меткой времени удаления рядом с ключом.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl_seconds: float, backend=None,
+                 bus: Optional[InvalidationBus] = None,
+                 encode: Callable[[Any], Any] = lambda value: value,
+                 decode: Callable[[Any], Any] = lambda value: value):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.bus = bus
+        self.encode = encode
+        self.decode = decode
+        self.hits = 0
+        self.misses = 0
+        self._l1 = TTLCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self._sequence = itertools.count(1)
+        # Номера последних удалений ключей (и сброса всего кэша)
+        self._deleted = TTLCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self._reset_seq = 0
+        if bus is not None:
+            bus.on(name, self.invalidate_local)
+
+    def _key(self, key: Hashable) -> str:
+        return f"cache:{self.name}:{key}"
+
+    def _deleted_key(self, key: Hashable) -> str:
+        return f"cache:{self.name}:{key}:deleted"
+
+    def begin_read(self, key: Hashable) -> Tuple[int, float]:
+        """Метка перед чтением значения из источника (БД) для set(..., since=метка)"""
+        return next(self._sequence), time.time()
+
+    def _deleted_since(self, key: Hashable, since: Tuple[int, float]) -> bool:
+        return max(self._deleted.get(key) or 0, self._reset_seq) > since[0]
+
+    def _mark_deleted(self, key: Any):
+        if key is None:
+            self._reset_seq = next(self._sequence)
+        else:
+            self._deleted.set(key, next(self._sequence))
+
+    def get(self, key: Hashable, remote: bool = True) -> Optional[Any]:
+        """remote=False - только L1; промах тогда не учитывается, если есть L2 (его проверит повторный вызов).
+
+        Чтение L2 - сетевой запрос: из async-кода вызывать через пул потоков.
+        """
+        item, tier = self._l1.get(key), "l1"
+        if item is None and self.backend is not None:
+            if not remote:
+                return None
+            item, tier = self._get_remote(key), "l2"
+            if item is not None:
+                self._l1.set(key, item)
+        if item is None:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(self.name, "miss")
+            return None
+        self.hits += 1
+        CACHE_LOOKUPS.inc(self.name, tier)
+        CACHE_ENTRY_AGE.observe(max(time.time() - item[0], 0.0), self.name)
+        return item[1]
+
+    def _get_remote(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        try:
+            raw = self.backend.get(self._key(key))
+            if raw is None:
+                return None
+            stored = json.loads(raw)
+            # Записано по чтению, начатому до удаления в другом процессе, - устарело
+            deleted_at = self.backend.get(self._deleted_key(key))
+            if deleted_at is not None and float(deleted_at) >= stored["stored_at"]:
+                return None
+            return stored["stored_at"], self.decode(stored["value"])
+        except Exception:
+            CACHE_BACKEND_ERRORS.inc("get")
+            return None
+
+    def set(self, key: Hashable, value: Any, since: Optional[Tuple[int, float]] = None):
+        """since - метка begin_read(): если ключ с тех пор удаляли, значение устарело и не кладется"""
+        if since is not None and self._deleted_since(key, since):
+            return
+        # С since возраст записи считается от начала чтения
+        item = (since[1] if since is not None else time.time(), value)
+        self._l1.set(key, item)
+        if self.backend is not None:
+            raw = json.dumps({"stored_at": item[0], "value": self.encode(value)}).encode()
+            backend_call(self.backend, "set", self.backend.set, self._key(key), raw, self.ttl_seconds)
+
+    def delete(self, key: Hashable):
+        self._mark_deleted(key)
+        self._l1.delete(key)
+        if self.backend is not None:
+            backend_call(self.backend, "delete", self.backend.delete, self._key(key))
+            # Метка удаления живет столько же, сколько запись: перекрывает запись по более раннему чтению
+            backend_call(self.backend, "set", self.backend.set, self._deleted_key(key),
+                         str(time.time()).encode(), self.ttl_seconds)
+        if self.bus is not None:
+            self.bus.publish(self.name, key)
+
+    def invalidate_local(self, key: Any = None):
+        self._mark_deleted(key)
+        if key is None:
+            self._l1.clear()
+        else:
+            self._l1.delete(key)
+
+    def __len__(self) -> int:
+        return len(self._l1)
+
+
+cache_backend = build_cache_backend()
+invalidation_bus = InvalidationBus(cache_backend)
@@ -0,0 +1,204 @@
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+from typing import Dict, List, Optional, Tuple
+
+# Модуль импортируется первым в main.py, поэтому сам не тянет ничего тяжелого
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "").strip().lower() in ("1", "true", "yes", "on")
+STARTUP_PROFILE_TOP = int(os.getenv("STARTUP_PROFILE_TOP") or 25)
+# Не чаще чем раз в столько секунд /health/ready перезапускает неудавшийся прогрев
+WARM_UP_RETRY_SECONDS = float(os.getenv("WARM_UP_RETRY_SECONDS") or 5)
+
+logger = logging.getLogger(__name__)
+
+
+class TimedLoader:
+    """Обертка загрузчика: меряет выполнение модуля, затем возвращает модулю исходный загрузчик"""
+
+    def __init__(self, loader, name: str, profile: "StartupProfile"):
+        self.loader = loader
+        self.name = name
+        self.profile = profile
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+        with self.profile.timed_import(self.name):
+            self.loader.exec_module(module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class ImportTimer(MetaPathFinder):
+    def __init__(self, profile: "StartupProfile"):
+        self.profile = profile
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = TimedLoader(spec.loader, fullname, self.profile)
+            return spec
+        return None
+
+
+class StartupProfile:
+    """Время импорта модулей (полное и собственное) и шагов инициализации"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports: Dict[str, Tuple[float, float]] = {}
+        self.steps: List[Tuple[str, float]] = []
+        self._stack: List[float] = []
+        self._finder: Optional[ImportTimer] = None
+
+    def install(self):
+        if self._finder is None:
+            self._finder = ImportTimer(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    @contextmanager
+    def timed_import(self, name: str):
+        # Время вложенных импортов вычитается из собственного времени родителя
+        self._stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - started
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += total
+            self.imports[name] = (total, total - children)
+
+    @contextmanager
+    def step(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started))
+
+    def report(self, top: int = STARTUP_PROFILE_TOP) -> str:
+        lines = [f"startup profile: {time.perf_counter() - self.started:.3f}s since profiling started, "
+                 f"{len(self.imports)} modules imported"]
+        lines.append(f"{'self ms':>9} {'total ms':>9}  module")
+        by_self = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (total, own) in by_self[:top]:
+            lines.append(f"{own * 1000:9.1f} {total * 1000:9.1f}  {name}")
+        if self.steps:
+            lines.append("init steps:")
+            for name, duration in self.steps:
+                lines.append(f"{duration * 1000:9.1f} ms  {name}")
+        return "\n".join(lines)
+
+
+startup_profile = StartupProfile()
+
+
+class Readiness:
+    """Готовность принимать трафик - отдельно от liveness (процесс жив)"""
+
+    def __init__(self):
+        self.ready = False
+        # Текст ошибки - только для логов: /health/ready публичный
+        self.error: Optional[str] = None
+        self.attempted_at = 0.0
+        self._lock = threading.Lock()
+        self._retry_lock = threading.Lock()
+
+    def status(self) -> dict:
+        return {"status": "ready" if self.ready else "not ready"}
+
+
+readiness = Readiness()
+
+
+def warm_password_backends():
+    # Загрузка backend-а bcrypt/argon2 - иначе ее оплачивает первый логин
+    from utils.security import pwd_context
+    for scheme in pwd_context.schemes():
+        pwd_context.handler(scheme).get_backend()
+
+
+def load_permissions():
+    # Матрица прав загружается один раз, дальше проверки идут без запросов в БД
+    from middlewares.authorization import permission_matrix
+    permission_matrix.load()
+
+
+def load_revoked_tokens():
+    # Отозванные токены проверяются по списку в памяти
+    from services.auth_tokens import load_revocations
+    load_revocations()
+
+
+def build_email_filter():
+    # Фильтр существующих email и хеш для проверки паролей несуществующих пользователей
+    from services.email_filter import email_filter
+    from services.password_hasher import password_hasher
+    email_filter.rebuild()
+    password_hasher.dummy_hash
+
+
+WARM_UP_STEPS = (
+    ("password backends", warm_password_backends),
+    ("email filter", build_email_filter),
+    ("permission matrix", load_permissions),
+    ("revocation list", load_revoked_tokens),
+)
+
+
+def warm_up() -> bool:
+    """Прогрев перед приемом трафика; ошибка (например, БД недоступна) не роняет процесс,
+    а оставляет readiness неготовым до следующей попытки (retry_warm_up)"""
+    with readiness._lock:
+        if readiness.ready:
+            return True
+        readiness.attempted_at = time.monotonic()
+        try:
+            for name, fn in WARM_UP_STEPS:
+                with startup_profile.step(name):
+                    fn()
+        except Exception as e:
+            readiness.error = f"{type(e).__name__}: {e}"
+            logger.exception("warm-up failed, will retry")
+            return False
+        readiness.ready = True
+        readiness.error = None
+        return True
+
+
+def retry_warm_up():
+    """Повтор прогрева в фоне, не чаще WARM_UP_RETRY_SECONDS: проверка готовности отвечает сразу"""
+    if readiness.ready or time.monotonic() - readiness.attempted_at < WARM_UP_RETRY_SECONDS:
+        return
+    # Повтор уже идет
+    if not readiness._retry_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            warm_up()
+        finally:
+            readiness._retry_lock.release()
+
+    threading.Thread(target=run, name="warm-up-retry", daemon=True).start()
@@ -0,0 +1,165 @@
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from database.config import env_int
+from database.db import SessionLocal, dialect_insert
+from models.role import Role
+from models.user import User, normalize_email
+from utils.security import hash_password
+
+PROVISION_BATCH_SIZE = env_int("PROVISION_BATCH_SIZE", 1000)
+PROVISION_WORKERS = env_int("PROVISION_WORKERS", os.cpu_count() or 2)
+PROVISION_DEFAULT_ROLE = "user"
+# Ключ записи, которую не удалось разобрать: строка учитывается как ошибочная, прогон продолжается
+PARSE_ERROR = "__parse_error__"
+
+@dataclass
+class ProvisionStats:
+    read: int = 0
+    created: int = 0
+    skipped: int = 0
+    failed: int = 0
+    errors: List[str] = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.read / self.elapsed if self.elapsed > 0 else 0.0
+
+    def fail(self, line: int, reason: str):
+        self.failed += 1
+        self.errors.append(f"line {line}: {reason}")
+
+    def __str__(self) -> str:
+        return (f"read={self.read} created={self.created} skipped={self.skipped} "
+                f"failed={self.failed} {self.rate:.1f} users/s")
+
+
+def iter_records(stream: TextIO, fmt: str) -> Iterator[dict]:
+    """Потоковое чтение CSV (с заголовком) или NDJSON - файл целиком в память не грузится"""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield {PARSE_ERROR: f"invalid JSON: {e}"}
+                    continue
+                yield record if isinstance(record, dict) else {PARSE_ERROR: "expected a JSON object"}
+    else:
+        raise ValueError(f"Unknown format {fmt}")
+
+
+def chunked(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    iterator = iter(records)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def resolve_roles(db: Session) -> Dict[str, int]:
+    return {name: role_id for role_id, name in db.execute(select(Role.id, Role.name))}
+
+
+def upsert_users(db: Session, rows: List[dict]) -> int:
+    # INSERT ... ON CONFLICT DO NOTHING, строки уходят одним executemany. Без цели конфликта:
+    # email уникален по индексу на lower(email), а не по колонке
+    insert = dialect_insert(db.get_bind())
+    statement = insert(User).on_conflict_do_nothing().returning(User.id)
+    return len(db.execute(statement, rows).all())
+
+
+class UserProvisioner:
+    """Массовое создание пользователей: роли один раз, хеши параллельно, вставка пачками"""
+
+    def __init__(self, executor: Executor, batch_size: int = PROVISION_BATCH_SIZE,
+                 default_role: str = PROVISION_DEFAULT_ROLE,
+                 on_progress: Optional[Callable[[ProvisionStats], None]] = None):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.default_role = default_role
+        self.on_progress = on_progress
+
+    def run(self, records: Iterable[dict], db: Optional[Session] = None) -> ProvisionStats:
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        stats = ProvisionStats()
+        try:
+            roles = resolve_roles(db)
+            for chunk in chunked(records, self.batch_size):
+                self._provision_chunk(db, chunk, roles, stats)
+                if self.on_progress:
+                    self.on_progress(stats)
+        finally:
+            if own_session:
+                db.close()
+        return stats
+
+    def _provision_chunk(self, db: Session, chunk: List[dict], roles: Dict[str, int], stats: ProvisionStats):
+        first_line = stats.read + 1
+        stats.read += len(chunk)
+
+        emails = {normalize_email(str(record.get("email") or "")) for record in chunk}
+        # Уже существующих не хешируем: повторный прогон того же файла почти бесплатен
+        existing = set(db.scalars(select(func.lower(User.email)).where(func.lower(User.email).in_(emails))))
+
+        pending, seen = [], set()
+        for line, record in enumerate(chunk, first_line):
+            email = normalize_email(str(record.get("email") or ""))
+            role_name = record.get("role") or self.default_role
+            if PARSE_ERROR in record:
+                stats.fail(line, record[PARSE_ERROR])
+            elif not email or not record.get("password"):
+                stats.fail(line, "email and password are required")
+            elif role_name not in roles:
+                stats.fail(line, f"role {role_name} not found")
+            elif email in existing or email in seen:
+                stats.skipped += 1
+            else:
+                seen.add(email)
+                pending.append({
+                    "first_name": record.get("first_name") or "",
+                    "last_name": record.get("last_name") or "",
+                    "email": email,
+                    "password": record["password"],
+                    "role_id": roles[role_name],
+                    "is_active": True,
+                })
+        if not pending:
+            return
+
+        chunksize = max(len(pending) // (4 * PROVISION_WORKERS), 1)
+        hashes = self.executor.map(hash_password, [row.pop("password") for row in pending], chunksize=chunksize)
+        for row, hashed in zip(pending, hashes):
+            row["hashed_password"] = hashed
+
+        created = upsert_users(db, pending)
+        db.commit()
+        stats.created += created
+        # Остальные успели появиться параллельно (конфликт по lower(email))
+        stats.skipped += len(pending) - created
+
+
+def make_executor(kind: str, workers: int) -> Executor:
+    # bcrypt/argon2 отпускают GIL, но процессы надежнее загружают все ядра
+    executor_class = ThreadPoolExecutor if kind == "thread" else ProcessPoolExecutor
+    return executor_class(max_workers=workers)
+
+
+def print_progress(stats: ProvisionStats):
+    print(f"\r{stats}", end="", file=sys.stderr, flush=True)
@@ -1,13 +1,14 @@
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from models.user import User
+from models.user import User, email_equals, normalize_email
 from models.role import Role
-from utils.security import hash_password
+from services.password_hasher import PasswordHasherBusy, password_hasher
 from database.db import SessionLocal
 
 def create_user_if_not_exists(first_name, last_name, email, password, role_name="user"):
     db: Session = SessionLocal()
     try:
-        existing = db.query(User).filter(User.email == email).first()
+        existing = db.query(User).filter(email_equals(email)).first()
         if existing:
             return existing
         role = db.query(Role).filter(Role.name == role_name).first()
@@ -16,8 +17,8 @@ def create_user_if_not_exists(first_name, last_name, email, password, role_name=
         user = User(
             first_name=first_name,
             last_name=last_name,
-            email=email,
-            hashed_password=hash_password(password),
+            email=normalize_email(email),
+            hashed_password=password_hasher.hash(password),
             role_id=role.id
         )
         db.add(user)
@@ -25,4 +26,24 @@ def create_user_if_not_exists(first_name, last_name, email, password, role_name=
         db.refresh(user)
         return user
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def rehash_user_password(user_id: int, old_hash: str, password: str):
+    """Перехеширование по текущей политике; запускается фоном после успешного входа"""
+    try:
+        new_hash = password_hasher.hash(password)
+    except PasswordHasherBusy:
+        # Не к спеху - перехешируем при следующем входе
+        return
+
+    db: Session = SessionLocal()
+    try:
+        # Условие по старому хешу: не затираем пароль, если его успели сменить
+        db.execute(
+            update(User)
+            .where(User.id == user_id, User.hashed_password == old_hash)
+            .values(hashed_password=new_hash)
+        )
+        db.commit()
+    finally:
+        db.close()
@@ -1,11 +1,17 @@
 import sys
 import os
+import json
+import time
+import uuid
 from pathlib import Path
 
 # Добавляем корневую директорию проекта в Python path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
+# Все тесты логинятся с одного адреса testclient - лимит по IP поднимаем
+os.environ.setdefault("LOGIN_IP_LIMIT", "10000")
+
 from main import app
 from fastapi.testclient import TestClient
 import pytest
@@ -13,6 +19,52 @@ import pytest
 client = TestClient(app)
 
 
+@pytest.fixture
+def query_audit():
+    """Все SQL-запросы за время теста; audit.reset() перед проверяемым вызовом"""
+    from services.query_audit import start_recording, stop_recording
+    audit = start_recording()
+    yield audit
+    stop_recording(audit)
+
+
+def register_user(prefix: str = "user", first_name: str = "Test", password: str = "testpass123") -> str:
+    """Регистрирует пользователя с ролью user и уникальным email (тесты можно перезапускать на той же БД)"""
+    email = f"{prefix}_{uuid.uuid4().hex[:8]}@example.com"
+    response = client.post("/auth/auth/register", json={
+        "first_name": first_name,
+        "last_name": "Test",
+        "email": email,
+        "password": password,
+        "role_id": 2
+    })
+    assert response.status_code == 200, response.text
+    return email
+
+
+def auth_headers(email: str, password: str = "testpass123") -> dict:
+    response = client.post("/auth/auth/login", json={"email": email, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def new_user_headers(prefix: str = "user", first_name: str = "Test") -> dict:
+    return auth_headers(register_user(prefix, first_name))
+
+
+def admin_headers() -> dict:
+    response = client.post("/auth/auth/login", json={"email": "admin@example.com", "password": "admin123"})
+    if response.status_code != 200:
+        pytest.skip("Admin account is deactivated")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def assert_query_budget(audit, method: str, route: str):
+    from services.query_audit import QUERY_BUDGETS
+    problems = audit.problems(QUERY_BUDGETS[(method, route)])
+    assert not problems, f"{method} {route}: {problems}"
+
+
 def test_main_endpoint():
     """Тест главной страницы"""
     response = client.get("/")
@@ -22,11 +74,12 @@ def test_main_endpoint():
 
 def test_auth_flow():
     """Тест полного цикла аутентификации"""
-    # Тестируем регистрацию
+    # Тестируем регистрацию (уникальный email - тест можно перезапускать на той же БД)
+    email = f"test_pytest_{uuid.uuid4().hex[:8]}@example.com"
     user_data = {
         "first_name": "Test",
         "last_name": "User",
-        "email": "test_pytest@example.com",
+        "email": email,
         "password": "testpass123",
         "role_id": 2
     }
@@ -36,7 +89,7 @@ def test_auth_flow():
 
     # Тестируем логин
     response = client.post("/auth/auth/login", json={
-        "email": "test_pytest@example.com",
+        "email": email,
         "password": "testpass123"
     })
     assert response.status_code == 200
@@ -80,45 +133,820 @@ def test_admin_access():
 def test_product_crud():
     """Тест CRUD операций с продуктами"""
     # Сначала регистрируем и логиним пользователя
-    user_data = {
-        "first_name": "Product",
-        "last_name": "Test",
-        "email": "product_test@example.com",
-        "password": "testpass123",
-        "role_id": 2
+    headers = new_user_headers("product_test", "Product")
+
+    # Создаем продукт
+    product_data = {
+        "name": "Test Product",
+        "description": "Test Description"
     }
+    response = client.post("/resource/products", headers=headers, json=product_data)
+    assert response.status_code == 200
+    product_id = response.json()["id"]
 
-    client.post("/auth/auth/register", json=user_data)
-    response = client.post("/auth/auth/login", json={
-        "email": "product_test@example.com",
-        "password": "testpass123"
+    # Получаем продукты
+    response = client.get("/resource/products", headers=headers)
+    assert response.status_code == 200
+
+    # Обновляем продукт
+    update_data = {
+        "name": "Updated Product",
+        "description": "Updated Description"
+    }
+    response = client.put(f"/resource/products/{product_id}", headers=headers, json=update_data)
+    assert response.status_code == 200
+
+    # Удаляем продукт
+    response = client.delete(f"/resource/products/{product_id}", headers=headers)
+    assert response.status_code == 200
+
+def test_permission_matrix_cache():
+    """Тест кэша матрицы прав"""
+    from middlewares.authorization import permission_matrix, PERMISSION_BITS
+    from models.role import Role
+    from database.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        user_role = db.query(Role).filter(Role.name == "user").first()
+    finally:
+        db.close()
+
+    permission_matrix.load()
+    loaded_at = permission_matrix._loaded_at
+
+    # Повторные проверки не перечитывают правила
+    mask = permission_matrix.get_mask(user_role.id, "products")
+    assert mask & PERMISSION_BITS["create"]
+    assert not mask & PERMISSION_BITS["update_all"]
+    assert permission_matrix._loaded_at == loaded_at
+
+    # После инвалидации матрица перечитывается
+    permission_matrix.invalidate()
+    assert permission_matrix.is_stale()
+    permission_matrix.get_mask(user_role.id, "products")
+    assert not permission_matrix.is_stale()
+
+
+def test_principal_cache_invalidation():
+    """Тест сброса кэша пользователя при изменении профиля и деактивации"""
+    email = register_user("principal", "Cache")
+    headers = auth_headers(email)
+
+    assert client.get("/users/me", headers=headers).json()["first_name"] == "Cache"
+
+    response = client.patch("/users/me", headers=headers, json={
+        "first_name": "Renamed",
+        "current_password": "testpass123"
     })
+    assert response.status_code == 200
+    assert client.get("/users/me", headers=headers).json()["first_name"] == "Renamed"
 
-    if response.status_code == 200:
-        token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
+    response = client.delete("/users/me", headers=headers)
+    assert response.status_code == 200
+    assert client.get("/users/me", headers=headers).status_code == 401
 
-        # Создаем продукт
-        product_data = {
-            "name": "Test Product",
-            "description": "Test Description"
-        }
-        response = client.post("/resource/products", headers=headers, json=product_data)
-        assert response.status_code == 200
-        product_id = response.json()["id"]
 
-        # Получаем продукты
-        response = client.get("/resource/products", headers=headers)
-        assert response.status_code == 200
+def test_password_hasher_backpressure():
+    """Тест отказа при переполнении пула хеширования"""
+    import threading
+    from services.password_hasher import PasswordHasher, PasswordHasherBusy
 
-        # Обновляем продукт
-        update_data = {
-            "name": "Updated Product",
-            "description": "Updated Description"
-        }
-        response = client.put(f"/resource/products/{product_id}", headers=headers, json=update_data)
-        assert response.status_code == 200
+    hasher = PasswordHasher(workers=1, queue_depth=0)
+    release = threading.Event()
+    try:
+        busy = hasher.submit(release.wait)
+        with pytest.raises(PasswordHasherBusy):
+            hasher.submit(release.wait)
+        release.set()
+        busy.result()
+        hasher.shutdown(wait=True)
+        # После освобождения слота пул снова принимает задачи
+        assert hasher.verify("secret", hasher.hash("secret"))
+    finally:
+        release.set()
+        hasher.shutdown()
+
+
+def test_rehash_on_login():
+    """Тест перехеширования пароля по текущей политике после входа"""
+    from database.db import SessionLocal
+    from models.user import User
+    from utils.security import build_password_context, password_needs_update
+
+    email = f"rehash_{uuid.uuid4().hex[:8]}@example.com"
+    old_hash = build_password_context(schemes=["bcrypt"], bcrypt_rounds=4).hash("testpass123")
+    assert password_needs_update(old_hash)
+
+    db = SessionLocal()
+    try:
+        db.add(User(first_name="Re", last_name="Hash", email=email, hashed_password=old_hash, role_id=2))
+        db.commit()
+    finally:
+        db.close()
+
+    response = client.post("/auth/auth/login", json={"email": email, "password": "testpass123"})
+    assert response.status_code == 200
+
+    db = SessionLocal()
+    try:
+        new_hash = db.query(User.hashed_password).filter(User.email == email).scalar()
+    finally:
+        db.close()
+    assert new_hash != old_hash
+    assert not password_needs_update(new_hash)
+
+
+def test_token_verifier_keyring():
+    """Тест проверки токенов по kid (RS256) и кэша проверенных токенов"""
+    rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+    from cryptography.hazmat.primitives import serialization
+    from utils.tokens import KeyRing, TokenVerifier
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+    issuer = KeyRing()
+    issuer.add_asymmetric("RS256", "key-1", private_key=private_pem, active=True)
+    token = TokenVerifier(issuer).sign({"user_id": 1, "exp": int(time.time()) + 60})
+
+    # Сервис проверки знает только публичный ключ
+    edge = KeyRing()
+    edge.add_asymmetric("RS256", "key-1", public_key=public_pem)
+    verifier = TokenVerifier(edge)
+    assert verifier.verify(token)["user_id"] == 1
+    assert verifier.verify(token)["user_id"] == 1
+    assert verifier.cache.hits == 1
+
+    assert verifier.verify(token[:-2] + "xx") is None
+    other = KeyRing()
+    other.add_asymmetric("RS256", "key-2", public_key=public_pem)
+    assert TokenVerifier(other).verify(token) is None
+
+
+def test_refresh_rotation_and_logout():
+    """Тест ротации refresh-токенов и отзыва токенов при выходе"""
+    email = register_user("refresh", "Refresh")
+    tokens = client.post("/auth/auth/login", json={"email": email, "password": "testpass123"}).json()
+    assert "refresh_token" in tokens
+
+    # Refresh-токен нельзя использовать как access-токен
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 401
+
+    response = client.post("/auth/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    rotated = response.json()
+
+    # Повторный обмен старого токена отзывает всю цепочку
+    response = client.post("/auth/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+    response = client.post("/auth/auth/refresh", json={"refresh_token": rotated["refresh_token"]})
+    assert response.status_code == 401
+
+    headers = {"Authorization": f"Bearer {rotated['access_token']}"}
+    assert client.get("/users/me", headers=headers).status_code == 200
+    assert client.post("/users/logout", headers=headers).status_code == 200
+    assert client.get("/users/me", headers=headers).status_code == 401
+
+
+def test_revocation_sync_and_cleanup():
+    """Тест догрузки отзыва, закоммиченного позже отзыва с большим id, и чистки истекших токенов"""
+    from datetime import datetime, timedelta
+    from sqlalchemy import delete, func, select
+    from database.db import SessionLocal
+    from models.refresh_token import RefreshToken
+    from models.revoked_token import RevokedToken
+    from services.auth_tokens import RevocationList, delete_expired_tokens
+
+    db = SessionLocal()
+    future = datetime.utcnow() + timedelta(hours=1)
+    base_id = db.scalar(select(func.max(RevokedToken.id))) or 0
+    jti_late, jti_early = uuid.uuid4().hex, uuid.uuid4().hex
+    try:
+        revocations = RevocationList()
+        db.add(RevokedToken(id=base_id + 2, jti=jti_early, expires_at=future))
+        db.commit()
+        revocations.sync(db)
+        assert revocations.is_revoked(jti_early)
+        # Меньший id стал виден после синхронизации - курсор его не пропускает
+        db.add(RevokedToken(id=base_id + 1, jti=jti_late, expires_at=future))
+        db.commit()
+        revocations.sync(db)
+        assert revocations.is_revoked(jti_late)
+
+        user_id = db.scalar(select(func.min(RefreshToken.user_id)))
+        if user_id is not None:
+            jti_expired = uuid.uuid4().hex
+            db.add(RefreshToken(jti=jti_expired, user_id=user_id, expires_at=datetime.utcnow() - timedelta(days=1)))
+            db.commit()
+            delete_expired_tokens(db)
+            assert db.scalar(select(RefreshToken.id).where(RefreshToken.jti == jti_expired)) is None
+    finally:
+        db.execute(delete(RevokedToken).where(RevokedToken.jti.in_([jti_late, jti_early])))
+        db.commit()
+        db.close()
+
+
+def test_users_keyset_pagination():
+    """Тест постраничного списка пользователей"""
+    headers = admin_headers()
+    for _ in range(3):
+        register_user("page", "Page")
+
+    response = client.get("/users/all", headers=headers, params={"limit": 2, "email_prefix": "page_"})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 2
+    assert "hashed_password" not in first_page[0]
+    assert all(user["email"].startswith("page_") for user in first_page)
+
+    next_after_id = response.headers["X-Next-After-Id"]
+    response = client.get("/users/all", headers=headers,
+                          params={"limit": 2, "email_prefix": "page_", "after_id": next_after_id})
+    assert all(user["id"] > int(next_after_id) for user in response.json())
+
+    # Префикс без учета регистра; % и _ - обычные символы, не шаблон LIKE
+    response = client.get("/users/all", headers=headers, params={"limit": 2, "email_prefix": "Page_"})
+    assert response.json() == first_page
+    for pattern in ("pag%", "pag_"):
+        assert client.get("/users/all", headers=headers, params={"email_prefix": pattern}).json() == []
+
+
+def test_products_streaming_export():
+    """Тест потоковой выгрузки продуктов в NDJSON и CSV"""
+    email = register_user("export", "Export")
+    headers = auth_headers(email)
+    for i in range(3):
+        client.post("/resource/products", headers=headers, json={"name": f"Export {i}", "description": "d"})
+
+    response = client.get("/resource/products", headers=headers, params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["name"] for row in rows] == ["Export 0", "Export 1", "Export 2"]
+
+    response = client.get("/resource/products", headers=headers, params={"format": "csv"})
+    lines = response.text.splitlines()
+    assert lines[0] == "id,name,description,owner_id"
+    assert len(lines) == 4
+
+
+def test_products_owner_scoped_pagination():
+    """Тест постраничного списка продуктов с учетом владельца"""
+    email = register_user("owner", "Owner")
+    headers = auth_headers(email)
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+    for i in range(3):
+        client.post("/resource/products", headers=headers, json={"name": f"Page {i}"})
+
+    response = client.get("/resource/products", headers=headers, params={"limit": 2})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 2
+    assert all(product["owner_id"] == user_id for product in first_page)
+    assert set(first_page[0]) == {"id", "name", "description", "owner_id"}
+
+    response = client.get("/resource/products", headers=headers,
+                          params={"limit": 2, "after_id": response.headers["X-Next-After-Id"]})
+    assert [product["name"] for product in response.json()] == ["Page 2"]
+
+
+def test_products_batch(monkeypatch):
+    """Тест пакетных операций с продуктами и частичных ошибок"""
+    from services import product_batch
+    headers, other_headers = [new_user_headers("batch", "Batch") for _ in range(2)]
+
+    response = client.post("/resource/products:batch", headers=headers,
+                           json={"items": [{"name": "B1"}, {"name": "B2"}, {"name": "B3"}]})
+    assert response.status_code == 200
+    assert response.json()["succeeded"] == 3
+    ids = [result["id"] for result in response.json()["results"]]
+    foreign_id = client.post("/resource/products", headers=other_headers, json={"name": "Foreign"}).json()["id"]
+
+    response = client.put("/resource/products:batch", headers=headers, json={"items": [
+        {"id": ids[0], "name": "B1 updated"},
+        {"id": foreign_id, "name": "Hijack"},
+        {"id": 10 ** 9, "name": "Missing"},
+    ]})
+    statuses = [result["status"] for result in response.json()["results"]]
+    assert statuses == [200, 403, 404]
+
+    response = client.request("DELETE", "/resource/products:batch", headers=headers, json={"ids": ids + [foreign_id]})
+    assert response.json()["succeeded"] == 3
+    assert response.json()["results"][-1]["status"] == 403
+
+    remaining = client.get("/resource/products", headers=headers).json()
+    assert not {product["id"] for product in remaining} & set(ids)
+
+    # Проверка владельца устарела (гонка с передачей продукта): запись все равно ограничена правами
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+    monkeypatch.setattr(product_batch, "load_owners", lambda db, ids, lock=False: {foreign_id: user_id})
+    response = client.put("/resource/products:batch", headers=headers, json={"items": [{"id": foreign_id, "name": "Hijack"}]})
+    assert response.json()["results"][0]["status"] == 404
+    response = client.request("DELETE", "/resource/products:batch", headers=headers, json={"ids": [foreign_id]})
+    assert response.json()["results"][0]["status"] == 404
+    foreign = [product for product in client.get("/resource/products", headers=other_headers).json()
+               if product["id"] == foreign_id]
+    assert [product["name"] for product in foreign] == ["Foreign"]
+
+
+def test_product_conditional_write():
+    """Тест однозапросного обновления/удаления: 404 для отсутствующего, 403 для чужого"""
+    headers, other_headers = [new_user_headers("cond", "Cond") for _ in range(2)]
+
+    product_id = client.post("/resource/products", headers=headers, json={"name": "Own"}).json()["id"]
+    response = client.put(f"/resource/products/{product_id}", headers=headers, json={"name": "Renamed", "description": "d"})
+    assert response.status_code == 200
+    assert response.json()["name"] == "Renamed"
+    assert response.json()["description"] == "d"
+
+    assert client.put(f"/resource/products/{product_id}", headers=other_headers, json={"name": "X"}).status_code == 403
+    assert client.delete(f"/resource/products/{product_id}", headers=other_headers).status_code == 403
+    assert client.put("/resource/products/1000000000", headers=headers, json={"name": "X"}).status_code == 404
+
+    assert client.delete(f"/resource/products/{product_id}", headers=headers).status_code == 200
+    assert client.delete(f"/resource/products/{product_id}", headers=headers).status_code == 404
+
+
+def test_bulk_user_provisioning():
+    """Тест массового создания пользователей: повторный прогон ничего не дублирует"""
+    from concurrent.futures import ThreadPoolExecutor
+    from services.user_provisioning import UserProvisioner, iter_records
+
+    prefix = uuid.uuid4().hex[:8]
+    lines = [json.dumps({"first_name": "Bulk", "last_name": str(i), "email": f"bulk_{prefix}_{i}@example.com",
+                         "password": "bulkpass123"}) for i in range(5)]
+    lines.append(json.dumps({"email": f"bulk_{prefix}_0@example.com", "password": "dup"}))
+    lines.append(json.dumps({"email": f"bulk_{prefix}_x@example.com", "password": "p", "role": "nope"}))
+    lines.append('{"email": "broken')
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        provisioner = UserProvisioner(executor, batch_size=3)
+        stats = provisioner.run(iter_records(lines, "ndjson"))
+        assert (stats.read, stats.created, stats.skipped, stats.failed) == (8, 5, 1, 2)
+        assert "invalid JSON" in stats.errors[-1]
+
+        stats = provisioner.run(iter_records(lines[:5], "ndjson"))
+        assert (stats.created, stats.skipped) == (0, 5)
+
+    response = client.post("/auth/auth/login", json={"email": f"bulk_{prefix}_3@example.com", "password": "bulkpass123"})
+    assert response.status_code == 200
+
+    # Конфликт по lower(email) (параллельная вставка, старая запись в другом регистре) - пропуск, не ошибка
+    from database.db import SessionLocal
+    from services.user_provisioning import upsert_users
+    db = SessionLocal()
+    try:
+        assert upsert_users(db, [{"first_name": "Bulk", "last_name": "Dup", "email": f"BULK_{prefix}_1@example.com",
+                                  "hashed_password": "x", "role_id": 2, "is_active": True}]) == 0
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_bootstrap_idempotent():
+    """Тест bootstrap: повторный запуск не дублирует роли и правила, возвращает права к спецификации"""
+    from sqlalchemy import func, select, update
+    from database.db import SessionLocal
+    from models.access_roles_rules import AccessRolesRules
+    from models.role import Role
+    from middlewares.authorization import invalidate_permissions
+    from services.init_roles import DEFAULT_RULES, bootstrap
+
+    db = SessionLocal()
+    user_role_id = db.scalar(select(Role.id).where(Role.name == "user"))
+    products_rule = (AccessRolesRules.role_id == user_role_id, AccessRolesRules.element == "products")
+    original = db.scalar(select(AccessRolesRules.create_permission).where(*products_rule))
+    try:
+        db.execute(update(AccessRolesRules).where(*products_rule).values(create_permission=False))
+        db.commit()
+
+        assert bootstrap() is False
+        assert bootstrap() is False
+
+        assert db.scalar(select(func.count()).select_from(Role)) == 2
+        rule_count = sum(len(elements) for elements in DEFAULT_RULES.values())
+        assert db.scalar(select(func.count()).select_from(AccessRolesRules)) == rule_count
+        assert db.scalar(select(AccessRolesRules.create_permission).where(*products_rule))
+    finally:
+        # Правило возвращается и при падении теста - иначе следующие тесты получат 403 на создание
+        db.rollback()
+        db.execute(update(AccessRolesRules).where(*products_rule).values(create_permission=original))
+        db.commit()
+        invalidate_permissions()
+        db.close()
+
+
+def test_health_and_startup_profile():
+    """Тест liveness/readiness без токена и профиля импорта"""
+    import importlib
+    import sys
+    from services.startup import StartupProfile, warm_up
+
+    assert client.get("/health/live").status_code == 200
+    # TestClient без контекстного менеджера не выполняет startup - прогреваемся сами
+    assert warm_up()
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+    profile = StartupProfile()
+    sys.modules.pop("colorsys", None)
+    profile.install()
+    try:
+        module = importlib.import_module("colorsys")
+        with profile.step("noop"):
+            pass
+    finally:
+        profile.uninstall()
+    assert "colorsys" in profile.imports
+    assert module.__loader__ is module.__spec__.loader
+    assert "colorsys" in profile.report()
+    assert profile.steps[0][0] == "noop"
+
+
+def test_readiness_retry(monkeypatch):
+    """Тест /health/ready при неудачном прогреве: без текста ошибки, повтор в фоне и не чаще интервала"""
+    from services import startup
+
+    attempts = []
+
+    def failing_step():
+        attempts.append(time.monotonic())
+        raise RuntimeError("could not connect to db.internal:5432")
+
+    assert startup.warm_up()
+    # Дожидаемся повтора, запущенного другими тестами
+    with startup.readiness._retry_lock:
+        pass
+    monkeypatch.setattr(startup.readiness, "ready", False)
+    monkeypatch.setattr(startup.readiness, "attempted_at", 0.0)
+    monkeypatch.setattr(startup, "WARM_UP_STEPS", (("database", failing_step),))
+
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json() == {"status": "not ready"}
+    deadline = time.monotonic() + 5
+    while not attempts and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with startup.readiness._retry_lock:
+        pass
+    assert len(attempts) == 1
+    # Повтор - не раньше WARM_UP_RETRY_SECONDS
+    assert client.get("/health/ready").status_code == 503
+    assert len(attempts) == 1
+
+    monkeypatch.setattr(startup, "WARM_UP_STEPS", ())
+    startup.readiness.attempted_at = 0.0
+    client.get("/health/ready")
+    deadline = time.monotonic() + 5
+    while not startup.readiness.ready and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.get("/health/ready").json() == {"status": "ready"}
+
+
+def test_metrics_endpoint():
+    """Тест /metrics: латентность по шаблону роута и число запросов к БД"""
+    headers = admin_headers()
+    client.put("/resource/products/1000000000", headers=headers, json={"name": "X"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_request_duration_seconds_count{method="PUT",route="/resource/products/{product_id}",status="404"}' in text
+    assert 'http_request_db_queries_bucket{method="PUT",route="/resource/products/{product_id}",le="+Inf"}' in text
+    assert 'password_hash_duration_seconds_count{operation="verify_password"}' in text
+    assert 'cache_hit_ratio{cache="token"}' in text
+    assert "db_query_duration_seconds_count" in text
+
+
+def test_query_budgets(query_audit):
+    """Тест бюджета запросов к БД на эндпоинты и детектора N+1"""
+    email = register_user("budget", "Budget")
+    headers = auth_headers(email)
+    for _ in range(3):
+        client.post("/resource/products", headers=headers, json={"name": "Budget"})
+    # Прогрев кэшей пользователя и прав
+    client.get("/users/me", headers=headers)
+
+    calls = [
+        ("POST", "/auth/auth/login", lambda: client.post("/auth/auth/login", json={"email": email, "password": "testpass123"})),
+        ("GET", "/users/me", lambda: client.get("/users/me", headers=headers)),
+        ("GET", "/resource/products", lambda: client.get("/resource/products", headers=headers)),
+        ("POST", "/resource/products", lambda: client.post("/resource/products", headers=headers, json={"name": "B"})),
+    ]
+    for method, route, call in calls:
+        query_audit.reset()
+        assert call().status_code == 200
+        assert_query_budget(query_audit, method, route)
+
+    # Загрузка по одному объекту в цикле - классический N+1
+    from database.db import SessionLocal
+    from models.product import Product
+    product_ids = [product["id"] for product in client.get("/resource/products", headers=headers).json()]
+    query_audit.reset()
+    db = SessionLocal()
+    try:
+        for product_id in product_ids:
+            db.get(Product, product_id)
+    finally:
+        db.close()
+    assert list(query_audit.repeated().values()) == [len(product_ids)]
+
+    # Изменение и удаление своей учетной записи, выход
+    new_email = f"budget_{uuid.uuid4().hex[:8]}@example.com"
+    account_calls = [
+        ("PATCH", "/users/me", lambda: client.patch("/users/me", headers=headers, json={
+            "first_name": "Budget2", "email": new_email, "current_password": "testpass123"})),
+        ("POST", "/users/logout", lambda: client.post("/users/logout", headers=headers)),
+        ("DELETE", "/users/me", lambda: client.delete("/users/me", headers=headers)),
+    ]
+    for method, route, call in account_calls:
+        if method == "DELETE":
+            # После выхода токен отозван - входим заново
+            headers = auth_headers(new_email)
+        client.get("/users/me", headers=headers)
+        query_audit.reset()
+        assert call().status_code == 200
+        assert_query_budget(query_audit, method, route)
+
+
+def test_query_budget_routes():
+    """Тест: каждый ключ QUERY_BUDGETS - реальный маршрут приложения"""
+    from services.query_audit import QUERY_BUDGETS
+    routes = {(method, route.path) for route in app.routes for method in getattr(route, "methods", None) or ()}
+    assert set(QUERY_BUDGETS) - routes == set()
+
+
+def test_login_rate_limit(monkeypatch):
+    """Тест лимита попыток логина: 429 с Retry-After без обращения к bcrypt"""
+    from services.password_hasher import password_hasher
+    from services.rate_limiter import LOGIN_EMAIL_LIMIT, MemoryBackend, SlidingWindowLimiter, login_email_limiter
+
+    # Время заморожено: на границе окон скользящее окно пропустило бы лишнюю попытку
+    frozen = time.time()
+    monkeypatch.setattr(login_email_limiter, "clock", lambda: frozen)
+    monkeypatch.setattr(login_email_limiter.backend, "clock", lambda: frozen)
+    email = f"limited_{uuid.uuid4().hex[:8]}@example.com"
+    for _ in range(LOGIN_EMAIL_LIMIT):
+        assert client.post("/auth/auth/login", json={"email": email, "password": "wrong"}).status_code == 401
+
+    calls = []
+    original_verify = password_hasher.verify
+    password_hasher.verify = lambda *args: calls.append(args) or original_verify(*args)
+    try:
+        response = client.post("/auth/auth/login", json={"email": email.upper(), "password": "wrong"})
+    finally:
+        password_hasher.verify = original_verify
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert calls == []
+
+    # Подмена левой записи X-Forwarded-For не обходит лимит по IP: считается запись доверенного прокси
+    from services import rate_limiter
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_TRUST_FORWARDED", True)
+    monkeypatch.setattr(rate_limiter.login_ip_limiter, "limit", 3)
+    monkeypatch.setattr(rate_limiter.login_ip_limiter, "clock", lambda: frozen)
+    proxy_seen_ip = f"2001:db8::{uuid.uuid4().hex[:4]}"
+    statuses = [
+        client.post("/auth/auth/login", headers={"X-Forwarded-For": f"10.0.{attempt}.1, {proxy_seen_ip}"},
+                    json={"email": f"xff_{uuid.uuid4().hex[:8]}@example.com", "password": "wrong"}).status_code
+        for attempt in range(4)
+    ]
+    assert statuses == [401, 401, 401, 429]
+
+    # Скользящее окно: предыдущее окно учитывается с убывающим весом
+    now = [1000.0]
+    limiter = SlidingWindowLimiter("test", 4, 10, MemoryBackend(clock=lambda: now[0]), clock=lambda: now[0])
+    assert [limiter.hit("ip") for _ in range(4)] == [0.0] * 4
+    assert limiter.hit("ip") == 10.0
+    # Отклоненная попытка тоже учтена: прошлое окно весит 5 * 0.5
+    now[0] = 1015.0
+    assert limiter.hit("ip") == 0.0
+    assert limiter.hit("ip") > 0
+    assert limiter.retry_after("ip") > 0
+
+    # Одновременные попытки: инкремент и решение атомарны, лишние не проходят
+    from concurrent.futures import ThreadPoolExecutor
+    burst = SlidingWindowLimiter("burst", 10, 60, MemoryBackend(clock=lambda: now[0]), clock=lambda: now[0])
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda _: burst.hit("ip"), range(64)))
+    assert results.count(0.0) == 10
+
+
+def test_unknown_email_login(query_audit, monkeypatch):
+    """Тест логина несуществующего email: без запроса к users, но с проверкой пароля"""
+    from services.email_filter import email_filter
+    from services.password_hasher import password_hasher
+
+    email = f"Mixed_{uuid.uuid4().hex[:8]}@Example.com"
+    response = client.post("/auth/auth/register", json={
+        "first_name": "Mixed", "last_name": "Case", "email": email, "password": "testpass123", "role_id": 2
+    })
+    assert response.status_code == 200
+    response = client.post("/auth/auth/login", json={"email": email.lower(), "password": "testpass123"})
+    assert response.status_code == 200
+    response = client.post("/auth/auth/register", json={
+        "first_name": "Mixed", "last_name": "Case", "email": email.upper(), "password": "testpass123", "role_id": 2
+    })
+    assert response.status_code == 400
+
+    email_filter.rebuild()
+    assert email_filter.might_exist(email.upper())
+
+    calls = []
+    original_submit = password_hasher.submit
+    password_hasher.submit = lambda fn, *args: calls.append(fn.__name__) or original_submit(fn, *args)
+    try:
+        query_audit.reset()
+        response = client.post("/auth/auth/login", json={
+            "email": f"missing_{uuid.uuid4().hex}@example.com", "password": "testpass123"
+        })
+    finally:
+        password_hasher.submit = original_submit
+    assert response.status_code == 401
+    assert not [statement for statement, _ in query_audit.statements if "FROM users" in statement]
+    assert calls == ["verify_password"]
+
+    # Новый пользователь сразу попадает в фильтр
+    email = register_user("fresh", "Fresh")
+    assert email_filter.might_exist(email)
+
+    # Фильтр другого процесса узнает о смене email из журнала, а пересборка идет в фоне
+    from database.db import SessionLocal
+    from models.user import User
+    from services.email_filter import EmailFilter
+    other = EmailFilter(sync_seconds=0)
+    other.rebuild()
+    headers = auth_headers(email)
+    changed = f"changed_{uuid.uuid4().hex[:8]}@example.com"
+    response = client.patch("/users/me", headers=headers,
+                            json={"email": changed, "current_password": "testpass123"})
+    assert response.status_code == 200
+    assert not other.might_exist(changed)
+
+    # Email занят параллельно, после проверки в обработчике: уникальный индекс -> 400, а не 500
+    from sqlalchemy import false
+    from routes import user_router, user_router_async
+    taken = register_user("taken", "Taken")
+    for module in (user_router, user_router_async):
+        monkeypatch.setattr(module, "email_equals", lambda _: false())
+    response = client.patch("/users/me", headers=headers,
+                            json={"email": taken.upper(), "first_name": "Race", "current_password": "testpass123"})
+    assert response.status_code == 400
+    monkeypatch.undo()
+    other.rebuild_seconds = 0
+    db = SessionLocal()
+    try:
+        assert other.may_exist(changed, db)
+    finally:
+        db.close()
+    for _ in range(100):
+        if not other._rebuilding:
+            break
+        time.sleep(0.05)
+    assert other.might_exist(changed) and not other._rebuilding
+
+    # Id, закоммиченный позже большего, перепроверяется, пока не истечет окно
+    from utils.id_cursor import IdCursor
+    now = [0.0]
+    cursor = IdCursor(gap_seconds=10, clock=lambda: now[0])
+    cursor.advance([1, 2, 5])
+    assert (cursor.last_id, sorted(cursor.gaps)) == (5, [3, 4])
+    cursor.advance([3])
+    assert sorted(cursor.gaps) == [4]
+    now[0] = 11.0
+    cursor.condition(User.id)
+    assert cursor.gaps == {}
+
+
+def test_tiered_cache_coherence():
+    """Тест общего L2 и рассылки сбросов между процессами (два воркера делят fake-backend)"""
+    from services.shared_cache import InvalidationBus, MemoryCacheBackend, TieredCache
+
+    backend = MemoryCacheBackend()
+    worker_a = TieredCache("test", 100, 60, backend=backend, bus=InvalidationBus(backend))
+    worker_b = TieredCache("test", 100, 60, backend=backend, bus=InvalidationBus(backend))
+
+    worker_a.set(1, "snapshot")
+    assert worker_b.get(1, remote=False) is None
+    assert worker_b.get(1) == "snapshot"
+    assert worker_b.get(1, remote=False) == "snapshot"
+
+    # Деактивация в одном воркере сбрасывает L1 другого и L2
+    worker_a.delete(1)
+    assert worker_b.get(1) is None
+    assert worker_b.hits == 2 and worker_b.misses == 1
+
+    response = client.get("/metrics")
+    assert 'cache_tier_lookups_total{cache="test",tier="l2"}' in response.text
+    assert 'cache_invalidation_lag_seconds_count{cache="test"} 1' in response.text
+
+    # Снимок, прочитанный из БД до удаления, не возвращается в кэш - ни в L1, ни в L2
+    since = worker_a.begin_read(2)
+    worker_b.delete(2)
+    worker_a.set(2, "stale", since=since)
+    assert worker_a.get(2) is None
+    lagging = TieredCache("test", 100, 60, backend=backend)
+    since = lagging.begin_read(3)
+    worker_b.delete(3)
+    lagging.set(3, "stale", since=since)
+    assert TieredCache("test", 100, 60, backend=backend).get(3) is None
+    since = worker_a.begin_read(3)
+    worker_a.set(3, "fresh", since=since)
+    assert TieredCache("test", 100, 60, backend=backend).get(3) == "fresh"
+
+    # Снимок пользователя в L2 - JSON; сетевой backend пишется из фонового потока
+    from dataclasses import asdict
+    from services.principal_cache import Principal, RoleRef
+    from services.shared_cache import background_writer
+
+    class SlowBackend(MemoryCacheBackend):
+        blocking = True
+
+    slow = SlowBackend()
+    writer = TieredCache("test_principal", 100, 60, backend=slow, encode=asdict, decode=Principal.from_dict)
+    reader = TieredCache("test_principal", 100, 60, backend=slow, encode=asdict, decode=Principal.from_dict)
+    principal = Principal(1, "A", "B", "a@example.com", 2, RoleRef(2, "user"), True, time.time())
+    writer.set(1, principal)
+    background_writer.flush(timeout=5)
+    assert json.loads(slow.get("cache:test_principal:1"))["value"]["role"] == {"id": 2, "name": "user"}
+    assert reader.get(1) == principal
+
+    # Переподключение подписки сбрасывает L1 целиком
+    bus = InvalidationBus(backend)
+    cache = TieredCache("test_reset", 100, 60, bus=bus)
+    cache.set(1, "value")
+    bus.reset_all()
+    assert cache.get(1) is None
+
+
+def test_resource_registry():
+    """Тест реестра ресурсов: биты прав и область видимости require()"""
+    from middlewares.authorization import PERMISSION_ACTIONS, PERMISSION_BITS
+    from middlewares.resources import PRODUCTS, Resource, require, resources
+
+    assert PRODUCTS.bits["update"] == (PERMISSION_BITS["update"], PERMISSION_BITS["update_all"])
+    assert PRODUCTS.bits["create"] == (PERMISSION_BITS["create"], PERMISSION_BITS["create"])
+    assert resources["users"].permissions == set(PERMISSION_ACTIONS)
+    assert Resource("reports", actions=("read",)).permissions == {"read"}
+    with pytest.raises(ValueError):
+        require("products", "publish")
+
+    # Без read_all в списке пользователей только сам пользователь
+    email = register_user("scope", "Scope")
+    headers = auth_headers(email)
+    response = client.get("/users/all", headers=headers)
+    assert response.status_code == 200
+    assert [user["email"] for user in response.json()] == [email]
+
+    # Имя роли не дает прав в обход правил: "admin" с правилами роли user видит только свое
+    from dataclasses import replace
+    from middlewares.authorization import has_permission
+    from services.principal_cache import RoleRef, fetch_principal
+    principal = fetch_principal(response.json()[0]["id"])
+    renamed = replace(principal, role=RoleRef(id=principal.role_id, name="admin"))
+    assert not PRODUCTS.grant(renamed, "read").scope_all
+    assert not has_permission(renamed, "products", "read_all")
+
+
+def test_row_level_scope(query_audit):
+    """Тест фильтра по владельцу в SQL: список без read_all и произвольный SELECT с JOIN"""
+    from sqlalchemy import select
+    from database.db import SessionLocal
+    from middlewares.resources import PRODUCTS
+    from models.product import Product
+    from models.user import User
+    from services.principal_cache import fetch_principal
+
+    owners = []
+    for _ in range(2):
+        email = register_user("rowscope", "Row")
+        headers = auth_headers(email)
+        client.post("/resource/products", headers=headers, json={"name": email, "description": "d"})
+        owners.append((email, headers))
+
+    # Один и тот же закэшированный запрос - разные параметры владельца
+    for email, headers in owners:
+        query_audit.reset()
+        response = client.get("/resource/products", headers=headers)
+        assert [product["name"] for product in response.json()] == [email]
+        assert any("products.owner_id = " in statement for statement, _ in query_audit.statements)
 
-        # Удаляем продукт
-        response = client.delete(f"/resource/products/{product_id}", headers=headers)
-        assert response.status_code == 200
\ No newline at end of file
+    db = SessionLocal()
+    try:
+        principal = fetch_principal(client.get("/users/me", headers=owners[0][1]).json()["id"])
+        grant = PRODUCTS.grant(principal, "read", db)
+        rows = db.execute(grant.scope(
+            select(Product.name, User.email).join(User, Product.owner_id == User.id)
+        )).all()
+    finally:
+        db.close()
+    assert rows == [(owners[0][0], owners[0][0])]
@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+from enum import Enum
+from typing import Iterable, Sequence
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy.sql import Select
+from database.db import SessionLocal, get_async_sessionmaker
+
+# Строк на одну выборку с курсора и на один отправляемый кусок ответа
+EXPORT_BATCH_SIZE = 1000
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv",
+}
+
+
+def encode_batch(rows: Sequence, columns: Sequence[str], fmt: ExportFormat) -> str:
+    if fmt == ExportFormat.ndjson:
+        return "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def csv_header(columns: Sequence[str]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    return buffer.getvalue()
+
+
+def iter_export(statement: Select, fmt: ExportFormat) -> Iterable[str]:
+    # Собственная сессия: ответ отдается уже после выхода из обработчика
+    statement = statement.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+    columns = list(statement.selected_columns.keys())
+    if fmt == ExportFormat.csv:
+        yield csv_header(columns)
+    db = SessionLocal()
+    try:
+        # Серверный курсор: в памяти не больше одной пачки строк
+        for batch in db.execute(statement).partitions():
+            yield encode_batch(batch, columns, fmt)
+    finally:
+        db.close()
+
+
+async def iter_export_async(statement: Select, fmt: ExportFormat):
+    statement = statement.execution_options(yield_per=EXPORT_BATCH_SIZE)
+    columns = list(statement.selected_columns.keys())
+    if fmt == ExportFormat.csv:
+        yield csv_header(columns)
+    async with get_async_sessionmaker()() as db:
+        result = await db.stream(statement)
+        async for batch in result.partitions():
+            yield encode_batch(batch, columns, fmt)
+
+
+def export_response(statement: Select, fmt: ExportFormat, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        iter_export(statement, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt.value}"'},
+    )
+
+
+def export_response_async(statement: Select, fmt: ExportFormat, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        iter_export_async(statement, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt.value}"'},
+    )
@@ -0,0 +1,43 @@
+import time
+from typing import Callable, Dict, Iterable
+
+from sqlalchemy import or_
+
+# Сколько секунд перепроверять пропущенные id и сколько их помнить (самые свежие)
+ID_GAP_SECONDS = 60
+ID_GAP_LIMIT = 1000
+
+
+class IdCursor:
+    """Курсор догрузки строк по возрастающему id.
+
+    Id коммитятся не по порядку: строка с меньшим id может стать видна позже строки с большим.
+    Пропущенные ниже курсора id перепроверяются gap_seconds, потом считаются откатом/удалением.
+    Не потокобезопасен - вызывающий держит свою блокировку.
+    """
+
+    def __init__(self, gap_seconds: float = ID_GAP_SECONDS, gap_limit: int = ID_GAP_LIMIT,
+                 clock: Callable[[], float] = time.monotonic):
+        self.gap_seconds = gap_seconds
+        self.gap_limit = gap_limit
+        self.clock = clock
+        self.last_id = 0
+        self.gaps: Dict[int, float] = {}
+
+    def condition(self, column):
+        now = self.clock()
+        self.gaps = {gap: seen for gap, seen in self.gaps.items() if now - seen < self.gap_seconds}
+        if self.gaps:
+            return or_(column > self.last_id, column.in_(sorted(self.gaps)))
+        return column > self.last_id
+
+    def advance(self, ids: Iterable[int]):
+        now = self.clock()
+        for row_id in sorted(ids):
+            self.gaps.pop(row_id, None)
+            if row_id > self.last_id:
+                for missing in range(max(self.last_id + 1, row_id - self.gap_limit), row_id):
+                    self.gaps[missing] = now
+                self.last_id = row_id
+        if len(self.gaps) > self.gap_limit:
+            self.gaps = {gap: self.gaps[gap] for gap in sorted(self.gaps)[-self.gap_limit:]}
@@ -0,0 +1,12 @@
+from fastapi import Response
+
+# Заголовок с курсором следующей страницы (id последней строки)
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+
+
+def keyset_page(rows, limit: int, response: Response) -> list:
+    """Строки страницы в виде словарей; для полной страницы выставляет курсор следующей"""
+    items = [dict(row._mapping) for row in rows]
+    if len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(items[-1]["id"])
+    return items
@@ -1,15 +1,59 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Optional, Dict
-import jwt
+from typing import Optional, Dict, Sequence, Tuple
+import os
+import uuid
+from database.config import env_int
+from utils.tokens import KeyRing, TokenVerifier
+from services.metrics import register_cache
 
 # ---------------- Config ----------------
-SECRET_KEY = "mysecretkey12345"  # В реальном проекте хранить в .env
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
+SECRET_KEY = os.getenv("JWT_SECRET", "mysecretkey12345")  # В реальном проекте хранить в .env
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+# Для RS256/EdDSA: приватный ключ подписи и публичные ключи для проверки ("kid=path,kid2=path2")
+JWT_KEY_ID = os.getenv("JWT_KEY_ID") or None
+JWT_PRIVATE_KEY_FILE = os.getenv("JWT_PRIVATE_KEY_FILE")
+JWT_PUBLIC_KEY_FILES = os.getenv("JWT_PUBLIC_KEY_FILES", "")
+# Короткоживущий access-токен + refresh-токен для его продления без ввода пароля
+ACCESS_TOKEN_EXPIRE_MINUTES = env_int("ACCESS_TOKEN_EXPIRE_MINUTES", 15)
+REFRESH_TOKEN_EXPIRE_DAYS = env_int("REFRESH_TOKEN_EXPIRE_DAYS", 7)
 
 # ---------------- Password Hashing ----------------
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Первая схема - для новых хешей, остальные только проверяются и перехешируются при входе
+PASSWORD_SCHEMES = [name.strip() for name in os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",") if name.strip()]
+BCRYPT_ROUNDS = env_int("BCRYPT_ROUNDS", 12)
+ARGON2_MEMORY_COST = env_int("ARGON2_MEMORY_COST", 65536)  # KiB
+ARGON2_TIME_COST = env_int("ARGON2_TIME_COST", 3)
+ARGON2_PARALLELISM = env_int("ARGON2_PARALLELISM", 4)
+
+
+def build_password_context(
+    schemes: Sequence[str] = PASSWORD_SCHEMES,
+    bcrypt_rounds: int = BCRYPT_ROUNDS,
+    argon2_memory_cost: int = ARGON2_MEMORY_COST,
+    argon2_time_cost: int = ARGON2_TIME_COST,
+    argon2_parallelism: int = ARGON2_PARALLELISM,
+) -> CryptContext:
+    """Политика хеширования паролей; хеши с другими параметрами считаются устаревшими"""
+    settings = {}
+    if "bcrypt" in schemes:
+        # min = max = rounds: needs_update срабатывает при любом изменении стоимости
+        settings.update(
+            bcrypt__rounds=bcrypt_rounds,
+            bcrypt__min_rounds=bcrypt_rounds,
+            bcrypt__max_rounds=bcrypt_rounds,
+        )
+    if "argon2" in schemes:
+        settings.update(
+            argon2__type="ID",
+            argon2__memory_cost=argon2_memory_cost,
+            argon2__time_cost=argon2_time_cost,
+            argon2__parallelism=argon2_parallelism,
+        )
+    return CryptContext(schemes=list(schemes), deprecated="auto", **settings)
+
+
+pwd_context = build_password_context()
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -17,18 +61,50 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def password_needs_update(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
 # ---------------- JWT ----------------
+def read_key_file(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def build_keyring() -> KeyRing:
+    keyring = KeyRing()
+    if ALGORITHM.startswith("HS"):
+        keyring.add_symmetric(SECRET_KEY, ALGORITHM, kid=JWT_KEY_ID)
+        return keyring
+
+    # Сервисы, которые только проверяют токены, получают одни публичные ключи
+    for item in filter(None, (part.strip() for part in JWT_PUBLIC_KEY_FILES.split(","))):
+        kid, path = item.split("=", 1)
+        keyring.add_asymmetric(ALGORITHM, kid, public_key=read_key_file(path))
+    if JWT_PRIVATE_KEY_FILE:
+        keyring.add_asymmetric(ALGORITHM, JWT_KEY_ID, private_key=read_key_file(JWT_PRIVATE_KEY_FILE), active=True)
+    return keyring
+
+
+token_verifier = TokenVerifier(build_keyring())
+register_cache("token", token_verifier.cache)
+
 def create_access_token(data: dict, expires_delta: int = ACCESS_TOKEN_EXPIRE_MINUTES) -> str:
     """Создание JWT токена"""
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=expires_delta)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=expires_delta)
+    to_encode.update({"exp": expire, "iat": now, "jti": uuid.uuid4().hex, "type": "access"})
+    encoded_jwt = token_verifier.sign(to_encode)
     return encoded_jwt
 
+def create_refresh_token(user_id: int, expires_days: int = REFRESH_TOKEN_EXPIRE_DAYS) -> Tuple[str, str, datetime]:
+    """Создание refresh-токена; возвращает токен, его jti и время истечения"""
+    now = datetime.utcnow()
+    expire = now + timedelta(days=expires_days)
+    jti = uuid.uuid4().hex
+    token = token_verifier.sign({"user_id": user_id, "exp": expire, "iat": now, "jti": jti, "type": "refresh"})
+    return token, jti, expire
+
 def decode_access_token(token: str) -> Optional[Dict]:
-    """Декодирование JWT токена"""
-    try:
-        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except jwt.PyJWTError:
-        return None
\ No newline at end of file
+    """Декодирование JWT токена (повторные токены берутся из кэша проверенных)"""
+    return token_verifier.verify(token)
\ No newline at end of file
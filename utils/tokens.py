@@ -0,0 +1,118 @@
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import jwt
+from jwt.algorithms import get_default_algorithms
+
+from utils.cache import TTLCache
+
+TOKEN_CACHE_SIZE = 4096
+# Для токенов без exp
+TOKEN_CACHE_DEFAULT_TTL = 60
+
+
+@dataclass(frozen=True)
+class TokenKey:
+    """Ключ подписи: kid, алгоритм и уже разобранный ключевой материал"""
+    kid: Optional[str]
+    algorithm: str
+    verify_key: Any
+    signing_key: Any = None
+
+
+def prepare_key(algorithm: str, key_material) -> Any:
+    # PEM разбирается один раз, дальше jwt получает готовый объект ключа
+    algorithms = get_default_algorithms()
+    if algorithm not in algorithms:
+        raise ValueError(f"Unsupported JWT algorithm {algorithm} (для RS256/EdDSA нужен пакет cryptography)")
+    return algorithms[algorithm].prepare_key(key_material)
+
+
+class KeyRing:
+    """Набор ключей по kid; активный ключ используется для подписи новых токенов"""
+
+    def __init__(self):
+        self._keys: Dict[Optional[str], TokenKey] = {}
+        self.active_kid: Optional[str] = None
+
+    def add_symmetric(self, secret: str, algorithm: str = "HS256", kid: Optional[str] = None, active: bool = True):
+        prepared = prepare_key(algorithm, secret)
+        self._add(TokenKey(kid=kid, algorithm=algorithm, verify_key=prepared, signing_key=prepared), active)
+
+    def add_asymmetric(self, algorithm: str, kid: str, public_key: Optional[str] = None,
+                       private_key: Optional[str] = None, active: bool = False):
+        signing_key = prepare_key(algorithm, private_key) if private_key else None
+        if public_key:
+            verify_key = prepare_key(algorithm, public_key)
+        elif signing_key is not None:
+            verify_key = signing_key.public_key()
+        else:
+            raise ValueError("public_key or private_key is required")
+        key = TokenKey(kid=kid, algorithm=algorithm, verify_key=verify_key, signing_key=signing_key)
+        self._add(key, active and signing_key is not None)
+
+    def _add(self, key: TokenKey, active: bool):
+        self._keys[key.kid] = key
+        if active or self.active_kid is None and key.signing_key is not None:
+            self.active_kid = key.kid
+
+    @property
+    def single(self) -> Optional[TokenKey]:
+        # Единственный ключ без kid: заголовок можно не разбирать, подпись все равно проверяется
+        if len(self._keys) == 1 and None in self._keys:
+            return self._keys[None]
+        return None
+
+    def get(self, kid: Optional[str]) -> Optional[TokenKey]:
+        key = self._keys.get(kid)
+        if key is None and kid is None:
+            # Токены без kid (выпущенные до ротации ключей) проверяем активным ключом
+            key = self._keys.get(self.active_kid)
+        return key
+
+    @property
+    def active(self) -> TokenKey:
+        key = self._keys.get(self.active_kid)
+        if key is None or key.signing_key is None:
+            raise RuntimeError("No signing key configured")
+        return key
+
+
+class TokenVerifier:
+    """Проверка JWT с LRU уже проверенных токенов (по дайджесту токена, с учетом exp)"""
+
+    def __init__(self, keyring: KeyRing, cache_size: int = TOKEN_CACHE_SIZE):
+        self.keyring = keyring
+        self.cache = TTLCache(max_size=cache_size, ttl_seconds=TOKEN_CACHE_DEFAULT_TTL)
+
+    def sign(self, claims: dict) -> str:
+        key = self.keyring.active
+        headers = {"kid": key.kid} if key.kid else None
+        return jwt.encode(claims, key.signing_key, algorithm=key.algorithm, headers=headers)
+
+    def verify(self, token: str) -> Optional[Dict]:
+        digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        claims = self.cache.get(digest)
+        if claims is not None:
+            return dict(claims)
+
+        claims = self._decode(token)
+        if claims is None:
+            return None
+
+        exp = claims.get("exp")
+        ttl = exp - time.time() if exp is not None else None
+        if ttl is None or ttl > 0:
+            self.cache.set(digest, claims, ttl)
+        return dict(claims)
+
+    def _decode(self, token: str) -> Optional[Dict]:
+        try:
+            key = self.keyring.single or self.keyring.get(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                return None
+            return jwt.decode(token, key.verify_key, algorithms=[key.algorithm])
+        except jwt.PyJWTError:
+            return None